@@ -0,0 +1,117 @@
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+from urllib.parse import parse_qs, urlsplit
+
+# secret.py 는 저장소에 없으므로 테스트용 키를 넣어 둔다
+sys.modules.setdefault(
+    "secret", types.SimpleNamespace(OPENWEATHERMAP_API_KEY="test-key")
+)
+
+from weather_provider import Facade, ForecastCache, WeatherProvider
+
+
+class ForecastHandler(BaseHTTPRequestHandler):
+    """OpenWeatherMap forecast 대신 쓰는 서버. 도시 이름 끝의 숫자가 섭씨 온도다"""
+
+    hits = Counter()
+    lock = threading.Lock()
+    delay = 0.2
+
+    def do_GET(self):
+        city = parse_qs(urlsplit(self.path).query)["q"][0].split(",")[0]
+        with self.lock:
+            self.hits[city] += 1
+        time.sleep(self.delay)
+
+        kelvin = 273.15 + int(city.lstrip("City") or 0)
+        body = json.dumps(
+            {
+                "list": [
+                    {"dt_txt": "2020-01-01 00:00:00", "main": {"temp": kelvin}},
+                    {"dt_txt": "2020-01-01 03:00:00", "main": {"temp": kelvin}},
+                    {"dt_txt": "2020-01-02 00:00:00", "main": {"temp": 0}},
+                ]
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FacadeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ForecastHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        ForecastHandler.hits.clear()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.facade = Facade(
+            ForecastCache(self.cache_dir.name),
+            WeatherProvider(f"http://127.0.0.1:{self.server.server_port}/forecast"),
+        )
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_concurrent_callers_share_one_upstream_request(self):
+        barrier = threading.Barrier(10)
+        results = []
+
+        def call():
+            barrier.wait()
+            results.append(self.facade.get_forecast("City7", "KR"))
+
+        threads = [threading.Thread(target=call) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(ForecastHandler.hits["City7"], 1)
+        self.assertEqual(len(results), 10)
+        for result in results:
+            self.assertAlmostEqual(result, 7)
+
+    def test_batch_keeps_request_order_and_fetches_each_key_once(self):
+        locations = [(f"City{i}", "KR") for i in (3, 1, 2)]
+        locations += [("city1 ", "kr"), ("City3", "KR")]
+
+        results = self.facade.get_forecasts(locations)
+
+        for result, expected in zip(results, [3, 1, 2, 1, 3]):
+            self.assertAlmostEqual(result, expected)
+        self.assertEqual(len(results), len(locations))
+        self.assertEqual(
+            dict(ForecastHandler.hits), {"City3": 1, "City1": 1, "City2": 1}
+        )
+
+    def test_batch_is_served_from_cache_afterwards(self):
+        locations = [(f"City{i}", "KR") for i in range(5)]
+        first = self.facade.get_forecasts(locations)
+        second = self.facade.get_forecasts(locations)
+
+        self.assertEqual(first, second)
+        self.assertEqual(sum(ForecastHandler.hits.values()), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
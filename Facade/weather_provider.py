@@ -1,90 +1,445 @@
-from datetime import datetime, timedelta
+import codecs
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import io
+from itertools import chain
 import json
+import os
 import pickle
+import re
+import threading
+import time
 from urllib.parse import quote
 from urllib.request import urlopen
 
+import numpy as np
+
 from secret import OPENWEATHERMAP_API_KEY
 
 
 class WeatherProvider:
-    def __init__(self):
-        self.api_url = (
-            "http://api.openweathermap.org/data/2.5/forecast?q={},{}&appid="
-            + OPENWEATHERMAP_API_KEY
-        )
+    def __init__(self, base_url="http://api.openweathermap.org/data/2.5/forecast"):
+        self.api_url = base_url + "?q={},{}&appid=" + OPENWEATHERMAP_API_KEY
 
     def get_weather_data(self, city, country):
+        return self.open_weather_stream(city, country).read()
+
+    def open_weather_stream(self, city, country):
         city = quote(city)
         url = self.api_url.format(city, country)
-        return urlopen(url).read()
+        return urlopen(url)
 
 
 class Parser:
-    def parse_weather_data(self, weather_data):
-        parsed = json.loads(weather_data)
+    list_start = re.compile(r'"list"\s*:\s*\[')
+
+    def parse_weather_data(self, weather_data, chunk_size=4096):
+        """첫째 날의 온도만 읽고, 날짜가 바뀌면 나머지는 읽지 않는다
+
+        weather_data 는 bytes 이거나 HTTP 응답처럼 read() 가 있는 스트림이다.
+        """
+
+        if isinstance(weather_data, str):
+            weather_data = weather_data.encode("utf-8")
+        if isinstance(weather_data, bytes):
+            weather_data = io.BytesIO(weather_data)
+
         start_date = None
         result = []
 
-        for data in parsed["list"]:
-            date = datetime.strptime(data["dt_txt"], "%Y-%m-%d %H:%M:%S")
+        for data in self._iter_forecasts(weather_data, chunk_size):
+            date = data["dt_txt"][:10]
             start_date = start_date or date
-            if start_date.date() != date.date():
-                return result
+            if start_date != date:
+                break
             result.append(data["main"]["temp"])
+        return result
+
+    def _iter_forecasts(self, stream, chunk_size):
+        """ "list" 배열의 원소를 하나씩 디코딩해서 돌려준다"""
+
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+        buffer = ""
+        pos = None
+        eof = False
+
+        while True:
+            if pos is None:
+                match = self.list_start.search(buffer)
+                if match:
+                    pos = match.end()
+                    continue
+            else:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buffer):
+                    if buffer[pos] == "]":
+                        return
+                    try:
+                        data, end = decoder.raw_decode(buffer, pos)
+                    except json.JSONDecodeError:
+                        if eof:
+                            raise
+                    else:
+                        yield data
+                        buffer = buffer[end:]
+                        pos = 0
+                        continue
+
+            if eof:
+                raise ValueError("Weather data has no complete forecast list")
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += text_decoder.decode(chunk, final=eof)
 
 
 class Cache:
-    def __init__(self, filename):
-        self.filename = filename
+    """(city, country) 마다 파일 하나씩 저장하는 디스크 캐시"""
+
+    def __init__(self, dirname, ttl=3 * 60 * 60):
+        self.dirname = dirname
+        self.ttl = ttl
 
-    def save(self, obj):
-        with open(self.filename, "wb") as file:
-            dct = {"obj": obj, "expired": datetime.utcnow() + timedelta(hours=3)}
+    def _path(self, key):
+        filename = "_".join(quote(part, safe="") for part in key)
+        return os.path.join(self.dirname, filename + ".p")
+
+    def save(self, key, obj):
+        os.makedirs(self.dirname, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        dct = {"obj": obj, "expired": time.time() + self.ttl}
+        with open(tmp_path, "wb") as file:
             pickle.dump(dct, file)
+        os.replace(tmp_path, path)
+        return dct["expired"]
 
-    def valid(self):
+    def load(self, key):
         try:
-            with open(self.filename, "rb") as file:
-                result = pickle.load(file)
-                if result["expired"] > datetime.utcnow():
-                    return result["obj"]
-        except IOError as e:
+            with open(self._path(key), "rb") as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except (IOError, EOFError, pickle.UnpicklingError) as e:
             print(f"Warning: {e}")
+            return None
+
+    def valid(self, key):
+        entry = self.load(key)
+        if entry and entry["expired"] > time.time():
+            return entry["obj"]
+
+
+class LRUCache:
+    """TTL 과 최대 크기를 가지는 프로세스 내 LRU 캐시
+
+    만료된 항목도 grace 초 동안은 남겨 두어 stale 값으로 돌려줄 수 있다.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3 * 60 * 60, grace=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.grace = grace
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """(obj, expired, hits) 를 돌려주며, grace 가 지난 항목은 버린다"""
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] + self.grace <= time.time():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            entry[2] += 1
+            self.hits += 1
+            return tuple(entry)
+
+    def set(self, key, obj, expired=None):
+        with self.lock:
+            self.entries[key] = [obj, expired or time.time() + self.ttl, 0]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+
+class ForecastCache:
+    """메모리 LRU 를 디스크 캐시 앞에 두는 2단계 캐시"""
+
+    def __init__(self, dirname, maxsize=1024, ttl=3 * 60 * 60, grace=0):
+        self.memory = LRUCache(maxsize, ttl, grace)
+        self.disk = Cache(dirname, ttl)
+        self.grace = grace
+        self.lock = threading.Lock()
+        self.disk_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(city, country):
+        return city.strip().lower(), country.strip().upper()
+
+    def get(self, key):
+        entry = self.lookup(key)
+        if entry and entry[1] > time.time():
+            return entry[0]
+
+    def lookup(self, key):
+        """grace 안에서 만료된 값까지 포함해 (obj, expired, hits) 를 돌려준다"""
+
+        entry = self.memory.get(key)
+        if entry is None:
+            disk_entry = self.disk.load(key)
+            if disk_entry and disk_entry["expired"] + self.grace > time.time():
+                self.memory.set(key, disk_entry["obj"], disk_entry["expired"])
+                entry = (disk_entry["obj"], disk_entry["expired"], 0)
+                with self.lock:
+                    self.disk_hits += 1
+
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            elif entry[1] <= time.time():
+                self.stale_hits += 1
+        return entry
+
+    def set(self, key, obj):
+        expired = self.disk.save(key, obj)
+        self.memory.set(key, obj, expired)
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory.hits,
+            "disk_hits": self.disk_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.memory.evictions,
+        }
 
 
 class Converter:
     def from_kelvin_to_celcius(self, kelvin):
         return kelvin - 273.15
 
+    def from_kelvin_to_celcius_array(self, kelvins):
+        return np.asarray(kelvins, dtype=np.float64) - 273.15
+
 
 class Weather:
     def __init__(self, data):
-        result = 0
-        for r in data:
-            result += r
-        self.temperature = result / len(data)
+        self.temperature = sum(data) / len(data)
+
+
+class WeatherTable:
+    """여러 지역의 예보를 NumPy 로 한 번에 집계한 열 단위 결과
+
+    series 는 지역마다 켈빈 온도 목록(또는 지역 x 시각의 2차원 배열)이고,
+    결과의 각 배열은 series 와 같은 순서이다.
+    """
+
+    def __init__(self, series, locations=None, percentiles=(10, 50, 90)):
+        converter = Converter()
+        if isinstance(series, np.ndarray) and series.ndim == 2:
+            table = converter.from_kelvin_to_celcius_array(series)
+            width = table.shape[1]
+            lengths = np.full(len(table), width, dtype=np.intp)
+        else:
+            lengths = np.fromiter(map(len, series), dtype=np.intp, count=len(series))
+            flat = np.fromiter(
+                chain.from_iterable(series),
+                dtype=np.float64,
+                count=int(lengths.sum()),
+            )
+            flat = converter.from_kelvin_to_celcius_array(flat)
+
+            width = int(lengths.max(initial=0))
+            table = np.full((len(series), width), np.nan)
+            table[np.arange(width) < lengths[:, None]] = flat
+
+        if lengths.size and lengths.min() == 0:
+            raise ValueError("Every location needs at least one temperature")
+
+        self.locations = list(locations) if locations is not None else None
+        self.count = lengths
+        self.mean = np.nansum(table, axis=1) / np.maximum(lengths, 1)
+        self.min = np.nanmin(table, axis=1, initial=np.inf)
+        self.max = np.nanmax(table, axis=1, initial=-np.inf)
+        self.percentiles = np.asarray(percentiles, dtype=np.float64)
+        if lengths.size and lengths.min() == width:
+            self.percentile_values = np.percentile(table, self.percentiles, axis=1).T
+        else:
+            self.percentile_values = np.nanpercentile(table, self.percentiles, axis=1).T
+
+    def __len__(self):
+        return len(self.count)
+
+
+class SingleFlight:
+    """같은 키로 동시에 들어온 호출을 하나의 실행으로 합친다"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def do(self, key, func, *args):
+        with self.lock:
+            future = self.in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self.in_flight[key] = Future()
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+
+class Refresher:
+    """만료됐거나 곧 만료될 예보를 백그라운드 워커에서 다시 가져온다"""
+
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="forecast-refresh"
+        )
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.refreshes = 0
+
+    def schedule(self, key, func, *args):
+        with self.lock:
+            if key in self.pending:
+                return False
+            self.pending.add(key)
+        self.executor.submit(self._run, key, func, *args)
+        return True
+
+    def _run(self, key, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"Warning: failed to refresh {key}: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+                self.refreshes += 1
 
 
 class Facade:
+    cache = ForecastCache("forecast_cache")
+    single_flight = SingleFlight()
+    refresher = Refresher()
+
+    def __init__(
+        self,
+        cache=None,
+        weather_provider=None,
+        max_workers=16,
+        refresh_ahead=0,
+        hot_hits=3,
+    ):
+        """refresh_ahead 초 안에 만료될 항목이 hot_hits 번 이상 읽혔다면 미리 갱신한다"""
+
+        if cache is not None:
+            self.cache = cache
+        self.weather_provider = weather_provider or WeatherProvider()
+        self.max_workers = max_workers
+        self.refresh_ahead = refresh_ahead
+        self.hot_hits = hot_hits
+
     def get_forecast(self, city, country):
-        cache = Cache("temp_cache")
+        key = self.cache.make_key(city, country)
 
-        cache_valid = cache.valid()
+        cache_valid = self._get_cached(key, city, country)
 
-        if cache_valid:
+        if cache_valid is not None:
             return cache_valid
-        weather_provider = WeatherProvider()
-        weather_data = weather_provider.get_weather_data(city, country)
+        return self.single_flight.do(key, self._fetch_forecast, key, city, country)
+
+    def get_forecasts(self, locations):
+        """여러 지역의 예보를 캐시에 없는 것만 동시에 가져온다"""
+
+        keys = [self.cache.make_key(city, country) for city, country in locations]
+        results = {}
+        missing = {}
+        for key, (city, country) in zip(keys, locations):
+            if key in results or key in missing:
+                continue
+            cache_valid = self._get_cached(key, city, country)
+            if cache_valid is not None:
+                results[key] = cache_valid
+            else:
+                missing[key] = (city, country)
+
+        if missing:
+            max_workers = min(self.max_workers, len(missing))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    key: executor.submit(
+                        self.single_flight.do,
+                        key,
+                        self._fetch_forecast,
+                        key,
+                        city,
+                        country,
+                    )
+                    for key, (city, country) in missing.items()
+                }
+                for key, future in futures.items():
+                    results[key] = future.result()
+
+        return [results[key] for key in keys]
+
+    def _get_cached(self, key, city, country):
+        """캐시 값을 돌려주고, stale 이거나 곧 만료될 hot 항목이면 갱신을 예약한다"""
+
+        entry = self.cache.lookup(key)
+        if entry is None:
+            return None
+
+        obj, expired, hits = entry
+        remaining = expired - time.time()
+        if remaining <= 0 or (
+            remaining <= self.refresh_ahead and hits >= self.hot_hits
+        ):
+            self.refresher.schedule(
+                key,
+                self.single_flight.do,
+                key,
+                self._fetch_forecast,
+                key,
+                city,
+                country,
+            )
+        return obj
 
+    def _fetch_forecast(self, key, city, country):
         parser = Parser()
-        parsed_data = parser.parse_weather_data(weather_data)
+        with self.weather_provider.open_weather_stream(city, country) as response:
+            parsed_data = parser.parse_weather_data(response)
 
         weather = Weather(parsed_data)
         converter = Converter()
         temperature_celcius = converter.from_kelvin_to_celcius(weather.temperature)
 
-        cache.save(temperature_celcius)
+        self.cache.set(key, temperature_celcius)
         return temperature_celcius
 
 
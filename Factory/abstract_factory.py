@@ -1,13 +1,14 @@
 import abc
 from urllib.error import URLError
-from urllib.request import urlopen
 
-from bs4 import BeautifulSoup
+from listing import iter_ftp_entries, iter_http_entries
+from transport import FTPTransport, HTTPTransport
 
 
 class AbstractFactory(abc.ABC):
-    def __init__(self, is_secure):
+    def __init__(self, is_secure, timeout=2):
         self.is_secure = is_secure
+        self.timeout = timeout
 
     @abc.abstractmethod
     def create_protocol(self):
@@ -21,6 +22,10 @@ class AbstractFactory(abc.ABC):
     def create_parser(self):
         pass
 
+    @abc.abstractmethod
+    def create_transport(self):
+        pass
+
 
 class HTTPFactory(AbstractFactory):
     def create_protocol(self):
@@ -32,6 +37,9 @@ class HTTPFactory(AbstractFactory):
     def create_parser(self):
         return HTTPParser()
 
+    def create_transport(self):
+        return HTTPTransport(self.create_port(), self.is_secure, self.timeout)
+
 
 class FTPFactory(AbstractFactory):
     def create_protocol(self):
@@ -43,34 +51,28 @@ class FTPFactory(AbstractFactory):
     def create_parser(self):
         return FTPParser()
 
+    def create_transport(self):
+        return FTPTransport(self.create_port(), self.timeout)
+
 
 class Parser(abc.ABC):
-    @abc.abstractmethod
     def __call__(self, content):
+        return "\n".join(entry.name for entry in self.entries(content))
+
+    @abc.abstractmethod
+    def entries(self, stream):
+        """bytes 나 응답 스트림을 조금씩 읽으며 Entry 를 하나씩 돌려준다"""
         pass
 
 
 class HTTPParser(Parser):
-    def __call__(self, content):
-        filenames = []
-        soup = BeautifulSoup(content, features="xml")
-        links = soup.find_all("a")
-        for link in links:
-            filenames.append(link.text)
-        return "\n".join(filenames)
+    def entries(self, stream):
+        return iter_http_entries(stream)
 
 
 class FTPParser(Parser):
-    def __call__(self, content):
-        content = content.decode("utf-8")
-        lines = content.split("\n")
-        filenames = []
-        for line in lines:
-            splitted_line = line.split(None, 8)
-            if len(splitted_line) == 9:
-                filenames.append(splitted_line[-1])
-
-        return "\n".join(filenames)
+    def entries(self, stream):
+        return iter_ftp_entries(stream)
 
 
 class Connector:
@@ -78,15 +80,28 @@ class Connector:
         self.protocol = factory.create_protocol()
         self.port = factory.create_port()
         self.parser = factory.create_parser()
+        self.transport = factory.create_transport()
 
     def read(self, host, path):
         url = f"{self.protocol}://{host}:{str(self.port)}{path}"
         print(f"Connection to {url}")
-        return urlopen(url, timeout=2).read()
+        return self.transport.read(host, path)
+
+    def read_many(self, locations, max_workers=8):
+        return self.transport.read_many(locations, max_workers)
 
     def parse(self, content):
         return self.parser(content)
 
+    def entries(self, stream):
+        return self.parser.entries(stream)
+
+    def iter_entries(self, host, path):
+        """목록 전체를 메모리에 두지 않고 응답을 읽는 대로 Entry 를 돌려준다"""
+
+        with self.transport.open(host, path) as response:
+            yield from self.parser.entries(response)
+
 
 class Port(abc.ABC):
     @abc.abstractmethod
@@ -1,15 +1,17 @@
 import abc
 from urllib.error import URLError
-from urllib.request import urlopen
 
-from bs4 import BeautifulSoup
+from listing import iter_ftp_entries, iter_http_entries
+from transport import FTPTransport, HTTPTransport
 
 
 class Connector(abc.ABC):
-    def __init__(self, is_secure):
+    def __init__(self, is_secure, timeout=2):
         self.is_secure = is_secure
+        self.timeout = timeout
         self.port = self.port_factory_method()
         self.protocol = self.protocol_factory_method()
+        self.transport = self.transport_factory_method()
 
     @abc.abstractmethod
     def protocol_factory_method(self):
@@ -20,13 +22,30 @@ class Connector(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def parse(self):
+    def transport_factory_method(self):
         pass
 
+    @abc.abstractmethod
+    def entries(self, stream):
+        """bytes 나 응답 스트림을 조금씩 읽으며 Entry 를 하나씩 돌려준다"""
+        pass
+
+    def parse(self, content):
+        return "\n".join(entry.name for entry in self.entries(content))
+
+    def iter_entries(self, host, path):
+        """목록 전체를 메모리에 두지 않고 응답을 읽는 대로 Entry 를 돌려준다"""
+
+        with self.transport.open(host, path) as response:
+            yield from self.entries(response)
+
     def read(self, host, path):
         url = f"{self.protocol}://{host}:{str(self.port)}{path}"
         print(f"Connection to {url}")
-        return urlopen(url, timeout=2).read()
+        return self.transport.read(host, path)
+
+    def read_many(self, locations, max_workers=8):
+        return self.transport.read_many(locations, max_workers)
 
 
 class HTTPConnector(Connector):
@@ -36,13 +55,11 @@ class HTTPConnector(Connector):
     def port_factory_method(self):
         return HTTPSPort() if self.is_secure else HTTPPort()
 
-    def parse(self, content):
-        filenames = []
-        soup = BeautifulSoup(content, features="xml")
-        links = soup.find_all("a")
-        for link in links:
-            filenames.append(link.text)
-        return "\n".join(filenames)
+    def transport_factory_method(self):
+        return HTTPTransport(self.port, self.is_secure, self.timeout)
+
+    def entries(self, stream):
+        return iter_http_entries(stream)
 
 
 class FTPConnector(Connector):
@@ -52,16 +69,11 @@ class FTPConnector(Connector):
     def port_factory_method(self):
         return FTPPort()
 
-    def parse(self, content):
-        content = content.decode("utf-8")
-        lines = content.split("\n")
-        filenames = []
-        for line in lines:
-            splitted_line = line.split(None, 8)
-            if len(splitted_line) == 9:
-                filenames.append(splitted_line[-1])
-
-        return "\n".join(filenames)
+    def transport_factory_method(self):
+        return FTPTransport(self.port, self.timeout)
+
+    def entries(self, stream):
+        return iter_ftp_entries(stream)
 
 
 class Port(abc.ABC):
@@ -0,0 +1,176 @@
+from collections import namedtuple
+import codecs
+from datetime import datetime
+from html.parser import HTMLParser
+import io
+import re
+from urllib.parse import unquote, urlsplit
+
+# href 는 HTML 목록의 링크 주소 그대로이고, FTP 목록에서는 None 이다
+Entry = namedtuple(
+    "Entry", ["name", "size", "mtime", "is_dir", "href"], defaults=(None,)
+)
+
+MONTHS = {
+    month: number
+    for number, month in enumerate(
+        [b"jan", b"feb", b"mar", b"apr", b"may", b"jun"]
+        + [b"jul", b"aug", b"sep", b"oct", b"nov", b"dec"],
+        start=1,
+    )
+}
+
+
+def as_stream(content):
+    """bytes 도 스트림처럼 읽을 수 있게 한다"""
+
+    if isinstance(content, (bytes, bytearray)):
+        return io.BytesIO(content)
+    return content
+
+
+def iter_lines(stream, chunk_size=64 * 1024):
+    """스트림을 조각으로 읽으면서 bytes 줄을 하나씩 돌려준다"""
+
+    rest = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+def parse_ls_time(month, day, time_or_year, now=None):
+    """ls -l 의 'Oct 18 18:14' 또는 'Oct 18 2020' 을 datetime 으로"""
+
+    month = MONTHS.get(month.lower())
+    if month is None:
+        return None
+    try:
+        if b":" in time_or_year:
+            now = now or datetime.now()
+            hour, minute = time_or_year.split(b":")
+            mtime = datetime(now.year, month, int(day), int(hour), int(minute))
+            # 연도가 없으면 최근 6개월 이내라는 뜻이라 미래면 작년이다
+            if mtime > now:
+                mtime = mtime.replace(year=now.year - 1)
+            return mtime
+        return datetime(int(time_or_year), month, int(day))
+    except ValueError:
+        return None
+
+
+def parse_size(size):
+    """'1234', '1.2K', '3M' 같은 크기를 바이트로. 디렉터리의 '-' 는 None"""
+
+    multiplier = 1
+    unit = size[-1:].upper()
+    if unit and unit in "KMGT":
+        multiplier = 1024 ** ("KMGT".index(unit) + 1)
+        size = size[:-1]
+    try:
+        return int(float(size) * multiplier)
+    except ValueError:
+        return None
+
+
+def iter_ftp_entries(stream, chunk_size=64 * 1024):
+    """unix ls -l 형식의 FTP LIST 출력을 Entry 로 하나씩 돌려준다"""
+
+    now = datetime.now()
+    for line in iter_lines(as_stream(stream), chunk_size):
+        fields = line.rstrip(b"\r").split(None, 8)
+        if len(fields) != 9:
+            continue
+
+        mode, _, _, _, size, month, day, time_or_year, name = fields
+        yield Entry(
+            name.decode("utf-8", errors="replace"),
+            int(size) if size.isdigit() else None,
+            parse_ls_time(month, day, time_or_year, now),
+            mode.startswith(b"d"),
+        )
+
+
+class ListingHTMLParser(HTMLParser):
+    """autoindex 페이지의 <a> 마다 링크 텍스트와 뒤따르는 날짜/크기를 모은다"""
+
+    details = re.compile(
+        r"\s*(\d{1,2}-[A-Za-z]{3}-\d{4} \d{2}:\d{2}|\d{4}-\d{2}-\d{2} \d{2}:\d{2})"
+        r"\s+(\S+)"
+    )
+
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+        self.link = None
+        self.pending = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            self._flush()
+            self.link = [dict(attrs).get("href") or "", []]
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self.link:
+            href, text = self.link
+            self.pending = [href, "".join(text), ""]
+            self.link = None
+
+    def handle_data(self, data):
+        if self.link:
+            self.link[1].append(data)
+        elif self.pending:
+            self.pending[2] += data
+            if "\n" in data:
+                self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+
+        href, name, tail = self.pending
+        self.pending = None
+        # 정렬 링크(?C=N)와 상위 디렉터리 링크는 목록의 항목이 아니다
+        if href.startswith(("?", "#")) or href.rstrip("/").endswith(".."):
+            return
+        # autoindex 는 긴 이름을 'name..>' 처럼 잘라서 보여 주므로 href 에서 이름을 얻는다
+        name = unquote(urlsplit(href).path.rstrip("/").rsplit("/", 1)[-1]) or name
+        size = mtime = None
+        match = self.details.match(tail)
+        if match:
+            for format in ("%d-%b-%Y %H:%M", "%Y-%m-%d %H:%M"):
+                try:
+                    mtime = datetime.strptime(match.group(1), format)
+                    break
+                except ValueError:
+                    pass
+            size = parse_size(match.group(2))
+        self.entries.append(Entry(name, size, mtime, href.endswith("/"), href))
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def iter_http_entries(stream, chunk_size=64 * 1024, encoding="utf-8"):
+    """HTML 디렉터리 목록을 조각으로 읽으며 <a> 마다 Entry 를 돌려준다"""
+
+    stream = as_stream(stream)
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    parser = ListingHTMLParser()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(decoder.decode(chunk))
+        yield from parser.entries
+        parser.entries.clear()
+
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    yield from parser.entries
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+
+class ListingCache:
+    """파싱한 디렉터리 목록을 담는 캐시
+
+    메모리 LRU 를 먼저 보고, dirname 이 있으면 키마다 파일 하나씩 저장하는 디스크 캐시를
+    뒤에 둔다. 값은 {"entries" 또는 "content", "etag", "last_modified", "expires"}
+    딕셔너리이다.
+    """
+
+    def __init__(self, maxsize=1024, dirname=None):
+        self.maxsize = maxsize
+        self.dirname = dirname
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.dirname, digest + ".p")
+
+    def get(self, key):
+        with self.lock:
+            record = self.entries.get(key)
+            if record is not None:
+                self.entries.move_to_end(key)
+                return record
+
+        if self.dirname:
+            try:
+                with open(self._path(key), "rb") as file:
+                    record = pickle.load(file)
+            except FileNotFoundError:
+                return None
+            except (IOError, EOFError, pickle.UnpicklingError) as e:
+                print(f"Warning: {e}")
+                return None
+            self._remember(key, record)
+            return record
+
+    def set(self, key, record):
+        self._remember(key, record)
+        if self.dirname:
+            os.makedirs(self.dirname, exist_ok=True)
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as file:
+                pickle.dump(record, file)
+            os.replace(tmp_path, path)
+
+    def _remember(self, key, record):
+        with self.lock:
+            self.entries[key] = record
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+class CachingConnector:
+    """Connector 의 read 결과와 파싱한 목록을 (protocol, host, port, path, field) 로 캐시하는 프록시
+
+    HTTP 는 http_ttl 초가 지나면 ETag/Last-Modified 로 조건부 요청을 보내 304 면 그대로
+    쓰고, FTP 는 검증 수단이 없으므로 ftp_ttl 초 동안 그대로 쓴 뒤 다시 읽는다.
+    parse() 는 네트워크를 쓰지 않으므로 connector 에 그대로 넘긴다.
+    """
+
+    def __init__(self, connector, cache=None, http_ttl=0, ftp_ttl=300):
+        self.connector = connector
+        self.cache = cache or ListingCache()
+        self.http_ttl = http_ttl
+        self.ftp_ttl = ftp_ttl
+
+    def read(self, host, path):
+        return self._fetch(host, path, "content", lambda response: response.read())
+
+    def parse(self, content):
+        return self.connector.parse(content)
+
+    def listing(self, host, path):
+        """connector.parse(connector.read(host, path)) 와 같은 문자열"""
+
+        return "\n".join(entry.name for entry in self.entries(host, path))
+
+    def entries(self, host, path):
+        return self._fetch(
+            host,
+            path,
+            "entries",
+            lambda response: tuple(self.connector.entries(response)),
+        )
+
+    def _fetch(self, host, path, field, build):
+        """캐시된 record[field] 를 돌려주거나, 응답을 build 한 값을 field 로 저장한다"""
+
+        protocol = self.connector.protocol
+        key = (protocol, host, self.connector.transport.port, path, field)
+        record = self.cache.get(key)
+        if record and record["expires"] > time.time():
+            return record[field]
+
+        is_http = protocol in ("http", "https")
+        headers = {}
+        if record and is_http:
+            if record["etag"]:
+                headers["If-None-Match"] = record["etag"]
+            if record["last_modified"]:
+                headers["If-Modified-Since"] = record["last_modified"]
+
+        ttl = self.http_ttl if is_http else self.ftp_ttl
+        with self.connector.transport.open(host, path, headers) as response:
+            if record and response.status == 304:
+                record = dict(record, expires=time.time() + ttl)
+            else:
+                record = {
+                    field: build(response),
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "expires": time.time() + ttl,
+                }
+        self.cache.set(key, record)
+        return record[field]
@@ -0,0 +1,243 @@
+import abc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import ftplib
+import http.client
+import threading
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin, urlsplit
+
+
+class Transport(abc.ABC):
+    """호스트마다 연결을 max_idle 개까지 열어 두고 다시 쓰는 전송 계층"""
+
+    def __init__(self, port, timeout=2, max_idle=4):
+        self.port = int(str(port))
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def acquire(self, key):
+        """(연결, 재사용 여부) 를 돌려준다. key 는 connect() 가 받는 연결 대상이다"""
+
+        with self.lock:
+            if self.idle[key]:
+                return self.idle[key].pop(), True
+        return self.connect(key), False
+
+    def release(self, key, connection):
+        with self.lock:
+            if len(self.idle[key]) < self.max_idle:
+                self.idle[key].append(connection)
+                return
+        self.disconnect(connection)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, defaultdict(list)
+        for connections in idle.values():
+            for connection in connections:
+                self.disconnect(connection)
+
+    def read(self, host, path):
+        with self.open(host, path) as response:
+            return response.read()
+
+    def read_many(self, locations, max_workers=8):
+        """[(host, path), ...] 를 최대 max_workers 개씩 동시에 읽어 같은 순서로 돌려준다"""
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda location: self.read(*location), locations))
+
+    @abc.abstractmethod
+    def open(self, host, path, headers=None):
+        """read() 가 있는 응답 스트림. 다 읽고 닫으면 연결이 풀로 돌아간다
+
+        headers 는 조건부 요청 같은 HTTP 요청 헤더이며 FTP 에서는 무시한다.
+        """
+        pass
+
+    @abc.abstractmethod
+    def connect(self, host):
+        pass
+
+    @abc.abstractmethod
+    def disconnect(self, connection):
+        pass
+
+
+class PooledResponse:
+    def __init__(self, stream, on_close, status=None, headers=None):
+        self.stream = stream
+        self.on_close = on_close
+        self.status = status
+        self.headers = headers or {}
+        self.closed = False
+
+    def read(self, size=None):
+        return self.stream.read(size)
+
+    def readinto(self, buffer):
+        return self.stream.readinto(buffer)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class HTTPTransport(Transport):
+    """keep-alive HTTP(S) 전송
+
+    풀의 키가 (is_secure, host, port) 라서 다른 스킴, 호스트, 포트로의 리다이렉트도
+    그 주소의 연결로 따라간다.
+    """
+
+    max_redirects = 5
+
+    def __init__(self, port, is_secure=False, timeout=2, max_idle=4):
+        super().__init__(port, timeout, max_idle)
+        self.is_secure = is_secure
+
+    def connect(self, origin):
+        is_secure, host, port = origin
+        if is_secure:
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def disconnect(self, connection):
+        connection.close()
+
+    def open(self, host, path, headers=None):
+        origin = (self.is_secure, host, self.port)
+        for _ in range(self.max_redirects + 1):
+            connection, response = self._request(origin, path, headers)
+            is_secure, host, port = origin
+            url = f"{'https' if is_secure else 'http'}://{host}:{port}{path}"
+
+            if response.status in (301, 302, 303, 307, 308):
+                location = response.getheader("Location")
+                self._finish(origin, connection, response)
+                origin, path = self._redirect_target(url, location)
+                continue
+
+            if response.status >= 400:
+                self._finish(origin, connection, response)
+                raise HTTPError(
+                    url, response.status, response.reason, response.headers, None
+                )
+
+            return PooledResponse(
+                response,
+                lambda: self._finish(origin, connection, response),
+                response.status,
+                response.headers,
+            )
+        raise URLError(f"Too many redirects for {url}")
+
+    @staticmethod
+    def _redirect_target(url, location):
+        """Location 을 ((is_secure, host, port), 쿼리를 포함한 경로) 로"""
+
+        parsed = urlsplit(urljoin(url, location or ""))
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise URLError(f"Unsupported redirect from {url} to {location}")
+        try:
+            port = parsed.port
+        except ValueError as e:
+            raise URLError(f"Invalid redirect from {url} to {location}") from e
+
+        is_secure = parsed.scheme == "https"
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        return (is_secure, parsed.hostname, port or (443 if is_secure else 80)), path
+
+    def _request(self, origin, path, headers=None):
+        connection, reused = self.acquire(origin)
+        while True:
+            try:
+                connection.request("GET", path, headers=headers or {})
+                return connection, connection.getresponse()
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                if not reused:
+                    raise URLError(e) from e
+            # 서버가 닫아 버린 keep-alive 연결이었다면 새 연결로 다시 시도한다
+            connection, reused = self.connect(origin), False
+
+    def _finish(self, origin, connection, response):
+        try:
+            if not response.isclosed():
+                response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            return
+        if response.will_close:
+            connection.close()
+        else:
+            self.release(origin, connection)
+
+
+class FTPTransport(Transport):
+    """익명 로그인한 제어 연결을 재사용한다. / 로 끝나는 경로는 LIST, 아니면 RETR"""
+
+    def connect(self, host):
+        ftp = ftplib.FTP(timeout=self.timeout)
+        try:
+            ftp.connect(host, self.port)
+            ftp.login()
+        except (ftplib.Error, OSError, EOFError) as e:
+            ftp.close()
+            raise URLError(e) from e
+        return ftp
+
+    def disconnect(self, connection):
+        try:
+            connection.quit()
+        except (ftplib.Error, OSError, EOFError):
+            connection.close()
+
+    def open(self, host, path, headers=None):
+        ftp, reused = self.acquire(host)
+        while True:
+            try:
+                data = self._transfer(ftp, path)
+                break
+            except ftplib.error_perm as e:
+                self.release(host, ftp)
+                raise URLError(f"ftp error: {e}")
+            except (ftplib.Error, OSError, EOFError) as e:
+                ftp.close()
+                if not reused:
+                    raise URLError(e) from e
+            # 서버가 닫아 버린 제어 연결이었다면 새 연결로 다시 시도한다
+            ftp, reused = self.connect(host), False
+
+        stream = data.makefile("rb")
+
+        def finish():
+            stream.close()
+            data.close()
+            try:
+                ftp.voidresp()
+            except (ftplib.Error, OSError, EOFError):
+                ftp.close()
+            else:
+                self.release(host, ftp)
+
+        return PooledResponse(stream, finish)
+
+    def _transfer(self, ftp, path):
+        if not path or path.endswith("/"):
+            ftp.voidcmd("TYPE A")
+            return ftp.transfercmd("LIST " + (path or "/"))
+        ftp.voidcmd("TYPE I")
+        return ftp.transfercmd("RETR " + path)
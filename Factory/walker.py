@@ -0,0 +1,141 @@
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+import ftplib
+import http.client
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+from abstract_factory import Connector, FTPFactory
+
+
+class RateLimiter:
+    """호스트마다 초당 rate 번까지만 요청을 보내게 한다"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_time = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time[host])
+            self.next_time[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class MirrorWalker:
+    """Connector 로 디렉터리를 재귀적으로 읽어 파일 목록을 흘려보낸다
+
+    찾은 하위 디렉터리는 곧바로 워커 풀에 목록 요청으로 들어가므로 여러 디렉터리를
+    동시에 읽는다. max_depth 는 root 아래로 몇 단계까지 내려갈지, include 는 돌려줄
+    파일의 패턴, exclude 는 건너뛸 파일과 디렉터리의 패턴, rate 는 호스트별 초당 요청 수이다.
+
+    HTTP 목록은 심볼릭 링크 고리가 a/a/a/... 처럼 끝없이 새 경로로 보이므로, 그런 서버를
+    돌 때는 max_depth 를 정해야 한다. None 이면 끝까지 내려간다.
+    """
+
+    def __init__(
+        self,
+        connector: Connector,
+        host,
+        max_workers=8,
+        max_depth=None,
+        include=None,
+        exclude=None,
+        rate=None,
+    ):
+        self.connector = connector
+        self.host = host
+        self.max_workers = max_workers
+        self.max_depth = max_depth
+        self.include = include or []
+        self.exclude = exclude or []
+        self.rate_limiter = RateLimiter(rate) if rate else None
+
+    def walk(self, root):
+        """(경로, Entry) 를 파일마다 하나씩 돌려준다"""
+
+        root = root if root.endswith("/") else root + "/"
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(self.list_directory, root): (root, 0)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, depth = pending.pop(future)
+                    try:
+                        entries = future.result()
+                    except (
+                        OSError,
+                        EOFError,
+                        http.client.HTTPException,
+                        ftplib.Error,
+                    ) as e:
+                        # URLError 는 연결과 요청에서, 나머지는 목록 본문을 읽다가 난다
+                        print(f"Can't list {path}: {e}")
+                        continue
+
+                    for entry in entries:
+                        child = self.child_path(path, entry)
+                        if child is None or self.is_excluded(child):
+                            continue
+
+                        if entry.is_dir:
+                            if self.max_depth is None or depth < self.max_depth:
+                                child += "/"
+                                future = executor.submit(self.list_directory, child)
+                                pending[future] = (child, depth + 1)
+                        elif self.is_included(child):
+                            yield child, entry
+
+    def child_path(self, path, entry):
+        """HTML 목록은 href 를, FTP 목록은 이름을 path 에 이어 붙인다. 끝의 / 는 뺀다
+
+        다른 호스트나 path 밖을 가리키는 링크는 None 이다.
+        """
+
+        if entry.href is None:
+            name = entry.name.rstrip("/")
+            if name in ("", ".", ".."):
+                return None
+            return path + name
+
+        try:
+            parsed = urlsplit(urljoin(path, entry.href))
+        except ValueError:
+            # http://[bad/ 같은 href 는 건너뛴다
+            return None
+        child = parsed.path.rstrip("/")
+        if parsed.netloc and parsed.hostname != self.host:
+            return None
+        if not child.startswith(path) or len(child) <= len(path):
+            return None
+        return child
+
+    def list_directory(self, path):
+        if self.rate_limiter:
+            self.rate_limiter.wait(self.host)
+        return list(self.connector.iter_entries(self.host, path))
+
+    def is_included(self, path):
+        return not self.include or any(fnmatch(path, p) for p in self.include)
+
+    def is_excluded(self, path):
+        return any(fnmatch(path, p) for p in self.exclude)
+
+
+if __name__ == "__main__":
+    connector = Connector(FTPFactory(False, timeout=10))
+    walker = MirrorWalker(
+        connector,
+        "ftp.freebsd.org",
+        max_depth=2,
+        exclude=["*/ISO-IMAGES-*"],
+        rate=5,
+    )
+
+    for path, entry in walker.walk("/pub/FreeBSD/"):
+        print(f"{path}\t{entry.size}\t{entry.mtime}")
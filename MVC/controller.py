@@ -1,4 +1,9 @@
-from flask import Flask, redirect, render_template, request
+from collections import OrderedDict
+import json
+import threading
+import time
+
+from flask import Flask, Response, jsonify, redirect, render_template, request
 from werkzeug.exceptions import BadRequest, NotFound
 
 import models
@@ -6,6 +11,70 @@ import models
 
 app = Flask(__name__, template_folder="views")
 
+# 예전 pickle 저장소가 남아 있으면 처음 뜰 때 한 번 옮긴다
+models.Url.import_legacy()
+
+
+class LinkCache:
+    """models.Url 조회 앞에 두는 읽기 캐시
+
+    최근에 쓰인 max_size 개의 매핑을 LRU 로 유지하고, 없는 코드는
+    negative_ttl 초 동안 없다고 기억해서 저장소를 다시 읽지 않는다.
+    """
+
+    def __init__(self, max_size=100000, negative_ttl=60):
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_full_url(self, short_url):
+        with self.lock:
+            entry = self.entries.get(short_url)
+            if entry is not None:
+                full_url, expired = entry
+                if expired is None or expired > time.time():
+                    self.entries.move_to_end(short_url)
+                    self.hits += 1
+                    return full_url
+                del self.entries[short_url]
+            self.misses += 1
+
+        url_model = models.Url.get_by_short_url(short_url)
+        if url_model:
+            entry = (url_model.full_url, None)
+        else:
+            entry = (None, time.time() + self.negative_ttl)
+
+        with self.lock:
+            self.entries[short_url] = entry
+            self.entries.move_to_end(short_url)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return entry[0]
+
+    def invalidate(self, short_url):
+        with self.lock:
+            self.entries.pop(short_url, None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+link_cache = LinkCache()
+
 
 @app.route("/")
 def index():
@@ -19,18 +88,72 @@ def shorten():
         raise BadRequest()
 
     url_model = models.Url.shorten(full_url)
+    link_cache.invalidate(url_model.short_url)
 
     short_url = request.host + "/" + url_model.short_url
     return render_template("success.html", short_url=short_url)
 
 
+@app.route("/shorten/bulk/", methods=["POST"])
+def shorten_bulk():
+    """JSON 배열이나 한 줄에 하나씩 적은 URL 들을 받아 결과를 한 줄씩 스트리밍한다"""
+
+    if request.is_json:
+        full_urls = request.get_json(silent=True)
+        if not isinstance(full_urls, list) or not all(
+            isinstance(full_url, str) for full_url in full_urls
+        ):
+            raise BadRequest()
+    else:
+        full_urls = request.get_data(as_text=True).splitlines()
+    full_urls = [full_url.strip() for full_url in full_urls if full_url.strip()]
+    if not full_urls:
+        raise BadRequest()
+
+    url_models = models.Url.shorten_many(full_urls)
+    for url_model in url_models:
+        link_cache.invalidate(url_model.short_url)
+
+    host = request.host
+
+    def generate():
+        for url_model in url_models:
+            yield json.dumps(
+                {
+                    "url": url_model.full_url,
+                    "short_url": host + "/" + url_model.short_url,
+                }
+            ) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@app.route("/_stats/link-cache")
+def link_cache_stats():
+    return jsonify(link_cache.stats())
+
+
 @app.route("/<path:path>")
 def redirect_to_full(path=""):
-    url_model = models.Url.get_by_short_url(path)
-    if not url_model:
+    full_url = link_cache.get_full_url(path)
+    if not full_url:
         raise NotFound()
 
-    return redirect(url_model.full_url)
+    return redirect(full_url)
+
+
+@app.cli.command("compact-links")
+def compact_links():
+    """저장된 매핑을 워커들이 mmap 으로 공유하는 인덱스 파일로 다시 쓴다"""
+
+    models.Url.storage.compact()
+
+
+@app.cli.command("import-legacy-links")
+def import_legacy_links():
+    """short_to_url.p / last_short.p 의 매핑을 SQLite 저장소로 옮긴다"""
+
+    print(f"Imported {models.Url.import_legacy()} links")
 
 
 if __name__ == "__main__":
@@ -1,66 +1,167 @@
+import os
 import pickle
+import string
+import threading
+
+from storage import PackedStorage, ShortUrlTaken, SQLiteStorage
+
+BASE62_ALPHABET = string.digits + string.ascii_lowercase + string.ascii_uppercase
+
+
+def to_base62(number):
+    """0 -> 0, 61 -> Z, 62 -> 10"""
+
+    if number == 0:
+        return BASE62_ALPHABET[0]
+
+    chars = []
+    while number:
+        number, remainder = divmod(number, 62)
+        chars.append(BASE62_ALPHABET[remainder])
+    return "".join(reversed(chars))
+
+
+def from_base62(code):
+    number = 0
+    for char in code:
+        number = number * 62 + BASE62_ALPHABET.index(char)
+    return number
+
+
+class LegacyUrl:
+    """예전 pickle 저장소에 들어 있던 Url 객체를 받는 자리"""
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if name == "Url":
+            return LegacyUrl
+        raise pickle.UnpicklingError(f"unexpected {module}.{name} in legacy mappings")
+
+
+class IdAllocator:
+    """저장소에서 ID 를 block_size 개씩 예약해 두고 하나씩 나눠 준다
+
+    예약은 저장소가 잠금으로 보장하므로 워커 프로세스끼리 ID 가 겹치지 않는다.
+    fork 이후에는 부모가 예약한 구간을 버리고 새로 예약한다.
+    """
+
+    def __init__(self, storage, block_size=1000):
+        self.storage = storage
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.pid = None
+        self.next_id = 0
+        self.end_id = 0
+
+    def allocate(self):
+        with self.lock:
+            if self.pid != os.getpid() or self.next_id >= self.end_id:
+                self.next_id = self.storage.reserve_ids(self.block_size)
+                self.end_id = self.next_id + self.block_size
+                self.pid = os.getpid()
+            allocated = self.next_id
+            self.next_id += 1
+            return allocated
+
+    def allocate_many(self, count):
+        """count 개의 연속된 ID 를 한 번의 예약으로 받는다"""
+
+        start = self.storage.reserve_ids(count)
+        return range(start, start + count)
 
 
 class Url:
+    __slots__ = ("full_url", "short_url")
+
+    storage = PackedStorage(SQLiteStorage())
+    id_allocator = IdAllocator(storage)
+
     @classmethod
     def shorten(cls, full_url: str):
         """전체 URL 줄이기"""
 
         instance = cls()
         instance.full_url = full_url
-        instance.short_url = instance.__create_short_url()
-        Url.__save_url_mapping(instance)
-        return instance
+        while True:
+            instance.short_url = instance.__create_short_url()
+            try:
+                cls.storage.put(instance.short_url, instance.full_url)
+            except ShortUrlTaken:
+                continue
+            return instance
 
     @classmethod
-    def get_by_short_url(cls, short_url: str):
-        url_mapping = Url.__load_url_mapping()
-        return url_mapping.get(short_url)
+    def shorten_many(cls, full_urls):
+        """여러 URL 을 한 번의 ID 예약과 한 번의 커밋으로 줄이기"""
 
-    def __create_short_url(self):
-        last_short_url = Url.__load_last_short_url()
-        short_url = self.__increment_string(last_short_url)
-        Url.__save_last_short_url(short_url)
-        return short_url
+        instances = []
+        for id_, full_url in zip(
+            Url.id_allocator.allocate_many(len(full_urls)), full_urls
+        ):
+            instance = cls()
+            instance.full_url = full_url
+            instance.short_url = to_base62(id_)
+            instances.append(instance)
 
-    def __increment_string(self, string):
-        """
-        a -> b
-        z -> aa
-        az -> ba
-        '' -> a
-        """
+        taken = set(
+            cls.storage.put_many(
+                (instance.short_url, instance.full_url) for instance in instances
+            )
+        )
+        for i, instance in enumerate(instances):
+            if instance.short_url in taken:
+                instances[i] = cls.shorten(instance.full_url)
+        return instances
 
-        if string == "":
-            return "a"
+    @classmethod
+    def get_by_short_url(cls, short_url: str):
+        full_url = cls.storage.get(short_url)
+        if full_url is None:
+            return None
 
-        last_char = string[-1]
+        instance = cls()
+        instance.full_url = full_url
+        instance.short_url = short_url
+        return instance
 
-        if last_char != "z":
-            return string[:-1] + chr(ord(last_char) + 1)
+    @classmethod
+    def import_legacy(
+        cls, mapping_file="short_to_url.p", last_short_file="last_short.p"
+    ):
+        """예전 pickle 저장소의 매핑을 옮기고, ID 카운터를 옛 코드들 뒤로 넘긴다
 
-        return self.__increment_string(string[:-1]) + "a"
+        옛 코드('a', 'z', 'aa' ...)도 base-62 로 읽으면 ID 이므로, 새로 나눠 주는 ID 가
+        그 코드들과 겹치지 않게 한다. 옮긴 뒤에는 파일 이름 뒤에 .imported 를 붙여서
+        다음 실행 때 다시 읽지 않는다. 옮긴 매핑 수를 돌려준다.
+        """
 
-    @staticmethod
-    def __load_last_short_url():
         try:
-            return pickle.load(open("last_short.p", "rb"))
-        except IOError:
-            return ""
-
-    @staticmethod
-    def __save_last_short_url(url):
-        pickle.dump(url, open("last_short.p", "wb"))
+            with open(mapping_file, "rb") as file:
+                mapping = LegacyUnpickler(file).load()
+        except FileNotFoundError:
+            return 0
 
-    @staticmethod
-    def __load_url_mapping():
+        pairs = [(short_url, url.full_url) for short_url, url in mapping.items()]
+        codes = list(mapping)
         try:
-            return pickle.load(open("short_to_url.p", "rb"))
-        except IOError:
-            return {}
-
-    @staticmethod
-    def __save_url_mapping(instance):
-        short_to_url = Url.__load_url_mapping()
-        short_to_url[instance.short_url] = instance
-        pickle.dump(short_to_url, open("short_to_url.p", "wb"))
+            with open(last_short_file, "rb") as file:
+                codes.append(LegacyUnpickler(file).load())
+        except FileNotFoundError:
+            pass
+
+        cls.storage.put_many(pairs)
+        next_id = max((from_base62(code) + 1 for code in codes if code), default=0)
+        current = cls.storage.reserve_ids(0)
+        if next_id > current:
+            cls.storage.reserve_ids(next_id - current)
+
+        for filename in (mapping_file, last_short_file):
+            try:
+                os.replace(filename, filename + ".imported")
+            except FileNotFoundError:
+                pass
+        return len(pairs)
+
+    def __create_short_url(self):
+        return to_base62(Url.id_allocator.allocate())
@@ -0,0 +1,265 @@
+import abc
+from array import array
+from bisect import bisect_left
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+
+
+class ShortUrlTaken(Exception):
+    pass
+
+
+class UrlStorage(abc.ABC):
+    """짧은 URL -> 전체 URL 매핑을 저장하는 백엔드"""
+
+    @abc.abstractmethod
+    def get(self, short_url):
+        """매핑이 없으면 None"""
+        pass
+
+    @abc.abstractmethod
+    def put(self, short_url, full_url):
+        """이미 있는 short_url 이면 ShortUrlTaken"""
+        pass
+
+    @abc.abstractmethod
+    def put_many(self, mappings):
+        """(short_url, full_url) 들을 한 번에 저장하고, 이미 있던 short_url 목록을 돌려준다"""
+        pass
+
+    @abc.abstractmethod
+    def reserve_ids(self, count):
+        """여러 프로세스 사이에서 겹치지 않는 ID 구간의 시작 값을 돌려준다"""
+        pass
+
+
+class SQLiteStorage(UrlStorage):
+    """WAL 모드 SQLite 에 매핑을 한 행씩 저장한다
+
+    쓰기는 한 행 INSERT 이고 읽기는 기본 키 조회라서 전체 매핑을 불러오지 않는다.
+    """
+
+    def __init__(self, filename="short_to_url.db"):
+        self.filename = filename
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(
+                self.filename, timeout=30, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS urls ("
+                "short_url TEXT PRIMARY KEY, full_url TEXT NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS counters ("
+                "name TEXT PRIMARY KEY, value INTEGER NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def get(self, short_url):
+        row = (
+            self.connection()
+            .execute("SELECT full_url FROM urls WHERE short_url = ?", (short_url,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def items(self):
+        """(short_url, full_url) 를 short_url 의 바이트 순서대로 돌려준다"""
+
+        return self.connection().execute(
+            "SELECT short_url, full_url FROM urls ORDER BY short_url"
+        )
+
+    def put(self, short_url, full_url):
+        try:
+            self.connection().execute(
+                "INSERT INTO urls (short_url, full_url) VALUES (?, ?)",
+                (short_url, full_url),
+            )
+        except sqlite3.IntegrityError:
+            raise ShortUrlTaken(short_url)
+
+    def put_many(self, mappings):
+        taken = []
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for short_url, full_url in mappings:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO urls (short_url, full_url) VALUES (?, ?)",
+                    (short_url, full_url),
+                )
+                if cursor.rowcount == 0:
+                    taken.append(short_url)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return taken
+
+    def reserve_ids(self, count):
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT value FROM counters WHERE name = 'url_id'"
+            ).fetchone()
+            start = row[0] if row else 0
+            connection.execute(
+                "INSERT OR REPLACE INTO counters (name, value) VALUES ('url_id', ?)",
+                (start + count,),
+            )
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return start
+
+
+class PackedIndex:
+    """mmap 으로 여는 읽기 전용 매핑 파일
+
+    헤더 | 고정 폭 코드(정렬, NUL 패딩) | 네이티브 uint64 오프셋 count+1 개 | UTF-8 URL 들
+    코드 영역을 이진 탐색하고 찾은 URL 만 디코딩한다.
+    """
+
+    header = struct.Struct("<8sIQ")
+    magic = b"URLIDX1\0"
+
+    def __init__(self, filename):
+        with open(filename, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.width, self.count = self.header.unpack_from(self.mmap, 0)
+        if magic != self.magic:
+            raise ValueError(f"{filename} is not a packed url index")
+        self.codes_start = self.header.size
+        self.offsets_start = self.codes_start + self.count * self.width
+        self.blob_start = self.offsets_start + (self.count + 1) * 8
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = self.codes_start + i * self.width
+        return self.mmap[start : start + self.width]
+
+    def get(self, short_url):
+        code = short_url.encode("utf-8")
+        if len(code) > self.width:
+            return None
+
+        code = code.ljust(self.width, b"\0")
+        i = bisect_left(self, code)
+        if i == self.count or self[i] != code:
+            return None
+
+        start, end = struct.unpack_from("=QQ", self.mmap, self.offsets_start + i * 8)
+        return self.mmap[self.blob_start + start : self.blob_start + end].decode(
+            "utf-8"
+        )
+
+    @classmethod
+    def write(cls, filename, items, count, width):
+        """정렬된 (short_url, full_url) 들로 새 파일을 만들어 원자적으로 바꿔 넣는다"""
+
+        dirname = os.path.dirname(os.path.abspath(filename))
+        offsets = array("Q", [0])
+        file = tempfile.NamedTemporaryFile(dir=dirname, delete=False)
+        try:
+            with file, tempfile.TemporaryFile(dir=dirname) as blob:
+                file.write(cls.header.pack(cls.magic, width, count))
+                for short_url, full_url in items:
+                    file.write(short_url.encode("utf-8").ljust(width, b"\0"))
+                    offsets.append(offsets[-1] + blob.write(full_url.encode("utf-8")))
+
+                file.write(offsets.tobytes())
+                blob.seek(0)
+                shutil.copyfileobj(blob, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(file.name, filename)
+        except BaseException:
+            os.unlink(file.name)
+            raise
+
+
+class PackedStorage(UrlStorage):
+    """PackedIndex 를 먼저 읽고, 없는 코드와 모든 쓰기는 writable 저장소로 보낸다
+
+    compact() 로 writable 의 내용을 새 인덱스로 만들어 두면 워커들은 이를 mmap 으로
+    공유한다. 워커는 reload_interval 초마다 파일이 바뀌었는지 확인해서 다시 연다.
+    """
+
+    def __init__(self, writable, filename="short_to_url.idx", reload_interval=5):
+        self.writable = writable
+        self.filename = filename
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.index = None
+        self.index_stat = None
+        self.checked = 0
+
+    def current_index(self):
+        if time.monotonic() - self.checked < self.reload_interval:
+            return self.index
+
+        with self.lock:
+            self.checked = time.monotonic()
+            try:
+                stat = os.stat(self.filename)
+            except FileNotFoundError:
+                self.index = self.index_stat = None
+                return None
+
+            stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if stat != self.index_stat:
+                self.index = PackedIndex(self.filename)
+                self.index_stat = stat
+            return self.index
+
+    def get(self, short_url):
+        index = self.current_index()
+        if index is not None:
+            full_url = index.get(short_url)
+            if full_url is not None:
+                return full_url
+        return self.writable.get(short_url)
+
+    def put(self, short_url, full_url):
+        self.writable.put(short_url, full_url)
+
+    def put_many(self, mappings):
+        return self.writable.put_many(mappings)
+
+    def reserve_ids(self, count):
+        return self.writable.reserve_ids(count)
+
+    def compact(self):
+        connection = self.writable.connection()
+        connection.execute("BEGIN")
+        try:
+            count, width = connection.execute(
+                "SELECT count(*), coalesce(max(length(CAST(short_url AS BLOB))), 0)"
+                " FROM urls"
+            ).fetchone()
+            PackedIndex.write(self.filename, self.writable.items(), count, width)
+        finally:
+            connection.execute("COMMIT")
+        self.checked = 0
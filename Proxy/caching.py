@@ -1,5 +1,10 @@
 import abc
-from random import random
+from collections import Counter, OrderedDict
+from functools import partial
+import threading
+import weakref
+
+import numpy as np
 
 
 class AbstractSubject(abc.ABC):
@@ -9,54 +14,267 @@ class AbstractSubject(abc.ABC):
 
 
 class ReadSubject(AbstractSubject):
-    def __init__(self):
-        self.digits = []
-        for _ in range(10000000):
-            self.digits.append(random())
+    """연속된 float64 버퍼 하나에 [0, 1) 난수를 담는다
+
+    buffer 는 정렬되면 항상 오름차순이고, 내림차순은 digits 가 돌려주는 뒤집힌 뷰다.
+    digits 를 직접 고쳤다면 is_sorted 를 False 로 돌려놓아야 한다.
+    """
+
+    def __init__(self, size=10000000, seed=None):
+        self.buffer = np.random.default_rng(seed).random(size)
+        self.is_sorted = False
+        self.reversed = False
+
+    @property
+    def digits(self):
+        return self.buffer[::-1] if self.reversed else self.buffer
 
     def sort(self, reverse: bool = False):
-        self.digits.sort()
-        if reverse:
-            self.digits.reverse()
+        if not self.is_sorted:
+            self.buffer.sort()
+            self.is_sorted = True
+        self.reversed = reverse
+
+    def top_k(self, k):
+        """가장 큰 k 개를 내림차순으로"""
+
+        k = max(0, min(k, len(self.buffer)))
+        if k == 0:
+            return self.buffer[:0]
+        if self.is_sorted:
+            return self.buffer[-k:][::-1]
+        largest = np.partition(self.buffer, len(self.buffer) - k)[-k:]
+        largest.sort()
+        return largest[::-1]
+
+    def bottom_k(self, k):
+        """가장 작은 k 개를 오름차순으로"""
+
+        k = max(0, min(k, len(self.buffer)))
+        if k == 0:
+            return self.buffer[:0]
+        if self.is_sorted:
+            return self.buffer[:k]
+        smallest = np.partition(self.buffer, k - 1)[:k]
+        smallest.sort()
+        return smallest
+
+    def rank(self, value):
+        """value 보다 작은 값의 개수"""
+
+        if self.is_sorted:
+            return int(np.searchsorted(self.buffer, value, side="left"))
+        return int(np.count_nonzero(self.buffer < value))
+
+    def quantile(self, q):
+        """np.quantile 의 linear 방식과 같은 값. 정렬돼 있으면 인덱스만 읽는다"""
+
+        q = np.asarray(q, dtype=np.float64)
+        if not np.all((0 <= q) & (q <= 1)):
+            raise ValueError("Quantiles must be in the range [0, 1]")
+        if not len(self.buffer):
+            raise ValueError("quantile of an empty buffer")
+        if not self.is_sorted:
+            return np.quantile(self.buffer, q)
+
+        position = q * (len(self.buffer) - 1)
+        low = np.floor(position).astype(np.intp)
+        high = np.minimum(low + 1, len(self.buffer) - 1)
+        fraction = position - low
+        return self.buffer[low] * (1 - fraction) + self.buffer[high] * fraction
+
+
+def subject_size(subject):
+    """subject 가 힙에 잡고 있는 바이트 수. 파일에 매핑된 버퍼는 세지 않는다"""
+
+    nbytes = getattr(subject, "nbytes", None)
+    if nbytes is not None:
+        return nbytes
+    buffer = getattr(subject, "buffer", None)
+    if buffer is None or isinstance(buffer, np.memmap):
+        return 0
+    return buffer.nbytes
+
+
+class SubjectRegistry:
+    """이름 붙은 subject 들을 처음 쓸 때 불러오고, 합계가 budget 바이트를 넘으면 내린다
+
+    내릴 때는 프록시가 하나도 없는 subject 를, 그 안에서는 가장 오래 안 쓴 것을 먼저
+    고른다. 방금 불러온 subject 는 내리지 않으므로 그 하나가 budget 보다 커도 된다.
+    내린 subject 는 약한 참조로만 남겨서, 밖에서 아직 쓰고 있으면 다시 불러오지 않고
+    그대로 되살린다. 프록시 수는 weakref.finalize 로 세므로 __del__ 순서와 상관없다.
+
+    내린 뒤에는 loader 를 다시 불러 만들므로 loader 는 매번 같은 데이터를 돌려줘야
+    한다(고정된 seed, 또는 같은 파일에서 다시 읽기). 내릴 때 정렬돼 있던 subject 는
+    다시 불러온 뒤 같은 방향으로 정렬해 둔다.
+    """
+
+    def __init__(self, budget=2 * 1024**3):
+        self.budget = budget
+        self.loaders = {}
+        self.subjects = OrderedDict()
+        self.sizes = {}
+        self.references = Counter()
+        self.evicted = {}
+        self.sort_states = {}
+        self.loading = {}
+        # release() 는 프록시의 finalizer 라서 이 잠금을 잡은 채로 돌던 GC 에서도 불린다
+        self.lock = threading.RLock()
+        self.hits = self.loads = self.revivals = self.evictions = 0
+
+    def register(self, name, loader):
+        """loader 는 인자 없이 subject 를 만들어 돌려주는, 재현 가능한 함수"""
+
+        with self.lock:
+            self.loaders[name] = loader
+
+    def get(self, name):
+        with self.lock:
+            subject = self._hit(name)
+            if subject is not None:
+                return subject
+            if name not in self.loaders:
+                raise KeyError(name)
+            loading = self.loading.setdefault(name, threading.Lock())
+
+        # 이름마다 한 번만 불러오고, 그동안 다른 이름의 조회는 막지 않는다
+        with loading:
+            with self.lock:
+                subject = self._hit(name)
+                if subject is not None:
+                    return subject
+                reference = self.evicted.pop(name, None)
+                subject = reference() if reference else None
+                loader = self.loaders[name]
+                reverse = self.sort_states.pop(name, None)
+
+            revived = subject is not None
+            if not revived:
+                subject = loader()
+                if reverse is not None:
+                    subject.sort(reverse=reverse)
+
+            with self.lock:
+                if revived:
+                    self.revivals += 1
+                else:
+                    self.loads += 1
+                self.subjects[name] = subject
+                self.sizes[name] = subject_size(subject)
+                self._evict(keep=name)
+            return subject
+
+    def _hit(self, name):
+        subject = self.subjects.get(name)
+        if subject is not None:
+            self.subjects.move_to_end(name)
+            self.hits += 1
+        return subject
+
+    def _evict(self, keep):
+        while sum(self.sizes.values()) > self.budget:
+            candidates = [name for name in self.subjects if name != keep]
+            if not candidates:
+                return
+            unused = [name for name in candidates if not self.references[name]]
+            self._drop((unused or candidates)[0])
+
+    def _drop(self, name):
+        subject = self.subjects.pop(name)
+        del self.sizes[name]
+        self.evicted[name] = weakref.ref(subject)
+        if getattr(subject, "is_sorted", False):
+            self.sort_states[name] = getattr(subject, "reversed", False)
+        self.evictions += 1
+
+    def evict(self, name):
+        with self.lock:
+            if name in self.subjects:
+                self._drop(name)
+
+    def acquire(self, owner, name):
+        """owner 가 살아 있는 동안 name 을 쓰고 있는 것으로 센다"""
+
+        with self.lock:
+            self.references[name] += 1
+            count = self.references[name]
+        weakref.finalize(owner, self.release, name)
+        return count
+
+    def release(self, name):
+        with self.lock:
+            self.references[name] -= 1
+            return self.references[name]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "loaded": list(self.subjects),
+                "bytes": sum(self.sizes.values()),
+                "budget": self.budget,
+                "hits": self.hits,
+                "loads": self.loads,
+                "revivals": self.revivals,
+                "evictions": self.evictions,
+            }
+
+
+registry = SubjectRegistry()
+registry.register("digits", partial(ReadSubject, seed=0))
 
 
 class Proxy(AbstractSubject):
-    reference_count = 0
+    """registry 의 name 을 가리키는 프록시. subject 는 처음 쓸 때 불러온다"""
 
-    def __init__(self):
-        if not getattr(Proxy, "cached_object", None):
-            Proxy.cached_object = ReadSubject()
-            print("Created new object")
-        else:
-            print("Using cached object")
-        Proxy.reference_count += 1
-        print(f"Count of references = {Proxy.reference_count}")
+    registry = registry
 
-    @classmethod
-    def sort(Proxy, reverse=False):
-        print("Called sort method with args:")
-        print(locals().items())
-        Proxy.cached_object.sort(reverse=reverse)
+    def __init__(self, name="digits"):
+        self.name = name
+        count = Proxy.registry.acquire(self, name)
+        print(f"Count of references to {name} = {count}")
+
+    @property
+    def cached_object(self):
+        return Proxy.registry.get(self.name)
+
+    def sort(self, reverse=False):
+        print(f"Called sort method of {self.name} with reverse={reverse}")
+        self.cached_object.sort(reverse=reverse)
 
-    def __del__(self):
-        Proxy.reference_count -= 1
+    def top_k(self, k):
+        return self.cached_object.top_k(k)
 
-        if Proxy.reference_count == 0:
-            print("Number of reference_count ids 0, Deleting cached object...")
-            del Proxy.cached_object
-        print(f"Deleted object. Count of objects = {Proxy.reference_count}")
+    def bottom_k(self, k):
+        return self.cached_object.bottom_k(k)
+
+    def rank(self, value):
+        return self.cached_object.rank(value)
+
+    def quantile(self, q):
+        return self.cached_object.quantile(q)
 
 
 if __name__ == "__main__":
+    registry.budget = 85 * 10**6
+    registry.register("small", partial(ReadSubject, 1000000, seed=1))
+
     proxy1 = Proxy()
     proxy2 = Proxy()
-    proxy3 = Proxy()
+    proxy3 = Proxy("small")
     print()
 
     proxy1.sort(reverse=True)
+    print(f"Top 3 = {proxy1.top_k(3)}, median = {proxy1.quantile(0.5):.6f}")
+    print(f"First 3 digits = {proxy1.cached_object.digits[:3]}")
     print()
 
-    del proxy2
+    proxy3.sort()
+    print(f"Bottom 3 of small = {proxy3.bottom_k(3)}")
+    print(registry.stats())
     print()
 
-    print("The other objects are deleted upon program termination")
+    del proxy2
+    print(f"References to digits = {registry.references['digits']}")
+    print(f"Top 3 after reload = {proxy1.top_k(3)}")
+    print(f"First 3 digits after reload = {proxy1.cached_object.digits[:3]}")
+    print(registry.stats())
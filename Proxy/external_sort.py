@@ -0,0 +1,261 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+
+import numpy as np
+
+from caching import AbstractSubject, ReadSubject
+
+
+def sort_run(filename, runs_filename, start, stop):
+    """filename 의 [start, stop) 구간을 메모리에서 정렬해 runs_filename 의 같은 자리에 쓴다"""
+
+    source = np.memmap(filename, np.float64, mode="r")
+    run = np.array(source[start:stop])
+    run.sort()
+    runs = np.memmap(runs_filename, np.float64, mode="r+")
+    runs[start:stop] = run
+    runs.flush()
+
+
+def merge_runs(runs, bounds, out, buffer_size):
+    """정렬된 구간들을 out 에 이어서 병합한다
+
+    구간마다 buffer_size // len(bounds) 개씩 읽고, 아직 더 읽을 것이 남은 구간들의
+    버퍼 끝값 중 가장 작은 값 이하인 원소는 모두 확정이므로 한꺼번에 정렬해 쓴다.
+    그 최솟값을 가진 버퍼는 매번 다 소비되므로 메모리는 buffer_size 근처에 머문다.
+    """
+
+    block = max(1, buffer_size // len(bounds))
+    positions = [start for start, _ in bounds]
+    written = 0
+    while True:
+        buffers = [
+            runs[position : min(position + block, stop)]
+            for position, (_, stop) in zip(positions, bounds)
+        ]
+        open_ends = [
+            buffer[-1]
+            for buffer, position, (_, stop) in zip(buffers, positions, bounds)
+            if position + len(buffer) < stop
+        ]
+        limit = min(open_ends) if open_ends else np.inf
+
+        taken = []
+        for i, buffer in enumerate(buffers):
+            count = int(np.searchsorted(buffer, limit, side="right"))
+            if count:
+                taken.append(buffer[:count])
+                positions[i] += count
+        if not taken:
+            return
+
+        merged = np.concatenate(taken)
+        merged.sort()
+        out[written : written + len(merged)] = merged
+        written += len(merged)
+
+
+def external_sort(
+    filename, output, chunk_size=2**24, buffer_size=2**24, max_workers=None
+):
+    """float64 파일을 chunk_size 개씩 병렬로 정렬한 뒤 k-way 병합해 output 에 쓴다
+
+    한 번에 메모리에 올리는 양은 워커마다 chunk_size 개, 병합에서 buffer_size 개 정도다.
+    """
+
+    size = os.path.getsize(filename) // 8
+    dirname = os.path.dirname(os.path.abspath(output))
+    bounds = [
+        (start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)
+    ]
+
+    runs_file = tempfile.NamedTemporaryFile(dir=dirname, suffix=".runs", delete=False)
+    out_file = tempfile.NamedTemporaryFile(dir=dirname, suffix=".sorted", delete=False)
+    try:
+        for file in (runs_file, out_file):
+            with file:
+                file.truncate(size * 8)
+        if size:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for _ in executor.map(
+                    sort_run,
+                    *zip(*[(filename, runs_file.name, *bound) for bound in bounds]),
+                ):
+                    pass
+
+            runs = np.memmap(runs_file.name, np.float64, mode="r")
+            out = np.memmap(out_file.name, np.float64, mode="r+")
+            merge_runs(runs, bounds, out, buffer_size)
+            out.flush()
+            del runs, out
+        os.replace(out_file.name, output)
+    except BaseException:
+        os.unlink(out_file.name)
+        raise
+    finally:
+        os.unlink(runs_file.name)
+
+
+class MappedReadSubject(ReadSubject):
+    """메모리보다 큰 float64 파일 위의 ReadSubject
+
+    buffer 는 np.memmap 이라 읽는 부분만 페이지 단위로 올라온다. sort() 는 외부 정렬로
+    filename + ".sorted" 를 만들고 그 파일로 buffer 를 바꾼다. 원본보다 새 정렬 파일이
+    이미 있으면 다시 정렬하지 않는다.
+    """
+
+    def __init__(
+        self,
+        filename,
+        size=None,
+        seed=None,
+        chunk_size=2**24,
+        buffer_size=2**24,
+        max_workers=None,
+    ):
+        self.filename = filename
+        self.sorted_filename = filename + ".sorted"
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.max_workers = max_workers
+        self.reversed = False
+
+        if not os.path.exists(filename):
+            self.generate(filename, size, seed, chunk_size)
+
+        self.is_sorted = os.path.exists(self.sorted_filename) and (
+            os.path.getmtime(self.sorted_filename) >= os.path.getmtime(filename)
+        )
+        self.buffer = self._open()
+
+    @staticmethod
+    def generate(filename, size, seed=None, chunk_size=2**24):
+        """[0, 1) 난수 size 개를 chunk_size 개씩 만들어 파일로 쓴다"""
+
+        if size is None:
+            raise ValueError(f"{filename} does not exist and size is not given")
+        rng = np.random.default_rng(seed)
+        with open(filename + ".tmp", "wb") as file:
+            for start in range(0, size, chunk_size):
+                file.write(rng.random(min(chunk_size, size - start)).tobytes())
+        os.replace(filename + ".tmp", filename)
+
+    def _open(self):
+        filename = self.sorted_filename if self.is_sorted else self.filename
+        if not os.path.getsize(filename):
+            return np.zeros(0)
+        return np.memmap(filename, np.float64, mode="r")
+
+    def sort(self, reverse: bool = False):
+        if not self.is_sorted:
+            external_sort(
+                self.filename,
+                self.sorted_filename,
+                self.chunk_size,
+                self.buffer_size,
+                self.max_workers,
+            )
+            self.is_sorted = True
+            self.buffer = self._open()
+        self.reversed = reverse
+
+    def chunks(self):
+        for start in range(0, len(self.buffer), self.chunk_size):
+            yield self.buffer[start : start + self.chunk_size]
+
+    def iter_blocks(self, block_size=2**20):
+        """digits 순서대로 block_size 개씩 메모리에 올린 배열을 돌려준다"""
+
+        digits = self.digits
+        for start in range(0, len(digits), block_size):
+            yield np.array(digits[start : start + block_size])
+
+    def top_k(self, k):
+        if self.is_sorted:
+            return super().top_k(k)
+        # 조각마다 상위 k 개만 남기면 전체를 메모리에 올리지 않아도 된다
+        k = max(0, min(k, len(self.buffer)))
+        best = np.zeros(0)
+        if k == 0:
+            return best
+        for chunk in self.chunks():
+            candidates = np.concatenate([best, chunk])
+            best = np.partition(candidates, max(0, len(candidates) - k))[-k:]
+        best.sort()
+        return best[::-1][:k]
+
+    def bottom_k(self, k):
+        if self.is_sorted:
+            return super().bottom_k(k)
+        k = max(0, min(k, len(self.buffer)))
+        best = np.zeros(0)
+        if k == 0:
+            return best
+        for chunk in self.chunks():
+            candidates = np.concatenate([best, chunk])
+            best = np.partition(candidates, min(k, len(candidates)) - 1)[:k]
+        best.sort()
+        return best[:k]
+
+    def rank(self, value):
+        if self.is_sorted:
+            return super().rank(value)
+        return sum(int(np.count_nonzero(chunk < value)) for chunk in self.chunks())
+
+    def quantile(self, q):
+        """정렬된 파일에서 인덱스로 읽는다. 정렬돼 있지 않으면 먼저 외부 정렬한다"""
+
+        if not self.is_sorted:
+            self.sort(reverse=self.reversed)
+        return super().quantile(q)
+
+
+class MappedProxy(AbstractSubject):
+    reference_count = 0
+    cached_object = None
+
+    def __init__(self, filename="digits.f64", size=10000000):
+        if MappedProxy.cached_object is None:
+            MappedProxy.cached_object = MappedReadSubject(filename, size)
+            print(f"Mapped {filename}")
+        else:
+            print("Using cached object")
+        MappedProxy.reference_count += 1
+        print(f"Count of references = {MappedProxy.reference_count}")
+
+    @classmethod
+    def sort(MappedProxy, reverse=False):
+        MappedProxy.cached_object.sort(reverse=reverse)
+
+    @classmethod
+    def top_k(MappedProxy, k):
+        return MappedProxy.cached_object.top_k(k)
+
+    @classmethod
+    def bottom_k(MappedProxy, k):
+        return MappedProxy.cached_object.bottom_k(k)
+
+    @classmethod
+    def rank(MappedProxy, value):
+        return MappedProxy.cached_object.rank(value)
+
+    @classmethod
+    def quantile(MappedProxy, q):
+        return MappedProxy.cached_object.quantile(q)
+
+    def __del__(self):
+        MappedProxy.reference_count -= 1
+
+        if MappedProxy.reference_count == 0:
+            print("Number of references is 0, unmapping...")
+            MappedProxy.cached_object = None
+
+
+if __name__ == "__main__":
+    proxy = MappedProxy()
+    print(f"Top 3 before sort = {proxy.top_k(3)}")
+    proxy.sort(reverse=True)
+    print(f"Top 3 = {proxy.top_k(3)}, median = {proxy.quantile(0.5):.6f}")
+    print(f"First block = {next(proxy.cached_object.iter_blocks(3))}")
+    del proxy
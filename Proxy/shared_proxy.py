@@ -0,0 +1,247 @@
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import ctypes
+import fcntl
+from multiprocessing import resource_tracker, shared_memory
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from caching import AbstractSubject, ReadSubject
+
+
+@contextmanager
+def segment_lock(name, shared=False):
+    """같은 이름의 세그먼트를 다루는 모든 프로세스 사이의 파일 잠금
+
+    shared 면 읽기끼리는 함께 잡히고, 정렬 같은 쓰기와는 서로 기다린다.
+    """
+
+    with open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), "a") as file:
+        fcntl.flock(file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+
+
+class Segment(shared_memory.SharedMemory):
+    """밖에 남은 배열 뷰가 있으면 닫지 않고, 뷰가 모두 사라질 때 매핑이 풀리게 둔다"""
+
+    def __del__(self):
+        try:
+            self.close()
+        except (BufferError, OSError):
+            pass
+
+    def unlink(self):
+        if sys.version_info < (3, 13):
+            # open_segment 에서 추적을 풀었지만 unlink() 는 한 번 더 풀려고 한다
+            resource_tracker.register(self._name, "shared_memory")
+        super().unlink()
+
+
+def open_segment(name, create=False, size=0):
+    """수명은 붙은 pid 표로 직접 관리하므로 resource_tracker 가 지우지 않게 한다"""
+
+    if sys.version_info >= (3, 13):
+        return Segment(name, create, size, track=False)
+    segment = Segment(name, create, size)
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedReadSubject(ReadSubject):
+    """이름 붙은 공유 메모리 세그먼트 위의 ReadSubject
+
+    int64 헤더 | float64 데이터. 헤더는 [채움 완료, 정렬됨, 크기, 붙은 pid * max_processes]
+    처음 연 프로세스가 데이터를 채우고, 나머지는 복사 없이 같은 버퍼를 본다.
+    붙은 pid 가 하나도 남지 않으면 마지막으로 close() 한 프로세스가 세그먼트를 지운다.
+    죽은 프로세스의 pid 는 붙거나 떨어질 때마다 정리된다.
+
+    배열은 ctypes 버퍼 위에 만든다. np.ndarray(buffer=segment.buf) 는 버퍼를 붙잡지
+    않아서, 뷰가 남은 채로 세그먼트를 닫으면 해제된 메모리를 읽게 된다.
+    """
+
+    max_processes = 256
+
+    def __init__(self, name="read_subject", size=10000000, seed=None):
+        self.name = name
+        self.pid = os.getpid()
+        self.reversed = False
+        header_size = (3 + self.max_processes) * 8
+        data_offset = -(-header_size // 64) * 64
+
+        with segment_lock(name):
+            try:
+                self.segment = open_segment(name, True, data_offset + size * 8)
+            except FileExistsError:
+                self.segment = open_segment(name)
+
+            raw = (ctypes.c_char * self.segment.size).from_buffer(self.segment.buf)
+            self.header = np.ndarray(3 + self.max_processes, np.int64, buffer=raw)
+            if not self.header[0]:
+                # 새로 만들었거나, 만들던 프로세스가 채우다 죽은 세그먼트
+                self.header[2] = size
+                self.buffer = self._data(raw, data_offset)
+                np.random.default_rng(seed).random(out=self.buffer)
+                self.header[1] = 0
+                self.header[0] = 1
+            else:
+                self.buffer = self._data(raw, data_offset)
+            self._attach()
+        self.closed = False
+        atexit.register(self.close)
+
+    def _data(self, raw, offset):
+        return np.ndarray(int(self.header[2]), np.float64, buffer=raw, offset=offset)
+
+    @property
+    def pids(self):
+        return self.header[3:]
+
+    def _prune(self):
+        for i, pid in enumerate(self.pids):
+            if pid and not is_alive(int(pid)):
+                self.pids[i] = 0
+
+    def _attach(self):
+        self._prune()
+        free = np.flatnonzero(self.pids == 0)
+        if not len(free):
+            raise RuntimeError(f"more than {self.max_processes} processes attached")
+        self.pids[free[0]] = self.pid
+
+    @property
+    def attached(self):
+        """이 세그먼트를 쓰고 있는 프로세스 수"""
+
+        return int(np.count_nonzero(self.pids))
+
+    @property
+    def is_sorted(self):
+        return bool(self.header[1])
+
+    @is_sorted.setter
+    def is_sorted(self, value):
+        self.header[1] = value
+
+    def sort(self, reverse: bool = False):
+        with segment_lock(self.name):
+            super().sort(reverse=reverse)
+
+    # 다른 프로세스가 제자리 정렬하는 중에 반쯤 섞인 버퍼를 읽지 않도록 공유 잠금을 잡는다.
+    # digits 를 직접 읽는다면 sort() 가 끝난 뒤에 읽어야 한다.
+
+    def top_k(self, k):
+        with segment_lock(self.name, shared=True):
+            return super().top_k(k)
+
+    def bottom_k(self, k):
+        with segment_lock(self.name, shared=True):
+            return super().bottom_k(k)
+
+    def rank(self, value):
+        with segment_lock(self.name, shared=True):
+            return super().rank(value)
+
+    def quantile(self, q):
+        with segment_lock(self.name, shared=True):
+            return super().quantile(q)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+
+        with segment_lock(self.name):
+            self.pids[self.pids == self.pid] = 0
+            self._prune()
+            if not self.attached:
+                self.segment.unlink()
+
+        del self.buffer, self.header
+        try:
+            self.segment.close()
+        except BufferError:
+            # 밖에서 digits 뷰를 잡고 있으면 그 뷰가 사라질 때 매핑이 풀린다
+            pass
+
+
+class SharedProxy(AbstractSubject):
+    """프로세스마다 세그먼트에 한 번만 붙고, 프로세스 안의 참조는 Proxy 처럼 센다"""
+
+    cached_object = None
+    reference_count = 0
+
+    def __init__(self, name="read_subject", size=10000000):
+        subject = SharedProxy.cached_object
+        # fork 로 물려받은 객체는 부모의 것이므로 새로 붙는다
+        if subject is None or subject.pid != os.getpid():
+            SharedProxy.cached_object = SharedReadSubject(name, size)
+            SharedProxy.reference_count = 0
+            print(f"Attached to {name}, processes = {self.cached_object.attached}")
+        else:
+            print("Using cached object")
+        SharedProxy.reference_count += 1
+        print(f"Count of references = {SharedProxy.reference_count}")
+
+    @classmethod
+    def sort(SharedProxy, reverse=False):
+        SharedProxy.cached_object.sort(reverse=reverse)
+
+    @classmethod
+    def top_k(SharedProxy, k):
+        return SharedProxy.cached_object.top_k(k)
+
+    @classmethod
+    def bottom_k(SharedProxy, k):
+        return SharedProxy.cached_object.bottom_k(k)
+
+    @classmethod
+    def rank(SharedProxy, value):
+        return SharedProxy.cached_object.rank(value)
+
+    @classmethod
+    def quantile(SharedProxy, q):
+        return SharedProxy.cached_object.quantile(q)
+
+    def __del__(self):
+        SharedProxy.reference_count -= 1
+
+        if SharedProxy.reference_count == 0 and SharedProxy.cached_object:
+            print("Number of references is 0, detaching from shared memory...")
+            SharedProxy.cached_object.close()
+            SharedProxy.cached_object = None
+
+
+def worker_top(k):
+    proxy = SharedProxy()
+    top = proxy.top_k(k)
+    attached = proxy.cached_object.attached
+    del proxy
+    return os.getpid(), attached, top
+
+
+if __name__ == "__main__":
+    proxy = SharedProxy()
+    proxy.sort(reverse=True)
+    print()
+
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        for pid, attached, top in executor.map(worker_top, [3] * 4):
+            print(f"pid {pid}: processes = {attached}, top 3 = {top}")
+    print()
+
+    del proxy
@@ -1,18 +1,63 @@
+import argparse
+import asyncio
+import codecs
+from collections import deque, OrderedDict
+import gzip
+import hashlib
+import heapq
+from html.parser import HTMLParser
+import itertools
+import json
+import math
 import os
+import queue
+import tempfile
 import threading
 from urllib import request
-from urllib.parse import urlparse, urljoin
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit, urlunsplit
+import zlib
 
-from bs4 import BeautifulSoup
+import aiohttp
 import httplib2
 
 
 class Singleton:
+    checkpoint = None
+
     def __new__(cls):
         if not hasattr(cls, "instance"):
             cls.instance = super().__new__(cls)
+            cls.instance.lock = threading.Lock()
         return cls.instance
 
+    def mark_downloaded(self, src):
+        """아직 받지 않은 src 면 맡고 True, 다른 스레드가 먼저 가져갔으면 False
+
+        체크포인트에는 record_downloaded 로 다 받은 뒤에 남긴다.
+        """
+
+        with self.lock:
+            if src in self.downloaded:
+                return False
+            self.downloaded.add(src)
+        return True
+
+    def record_downloaded(self, src):
+        if self.checkpoint:
+            self.checkpoint.record("downloaded", src)
+
+    def mark_visited(self, url):
+        self.to_visit.add(url)
+        if self.checkpoint:
+            self.checkpoint.record("visited", url)
+
+    def mark_processed(self, url):
+        """이미지 워커가 url 페이지를 끝냈다"""
+
+        if self.checkpoint:
+            self.checkpoint.record("processed", url)
+
 
 class ImageDownLoaderThread(threading.Thread):
     def __init__(self, thread_id, name, counter):
@@ -25,92 +70,614 @@ class ImageDownLoaderThread(threading.Thread):
         print(f"Finished thread {self.name}")
 
 
-def traverse_site(max_links=10):
-    link_parser_singleton = Singleton()
+class ImageStore:
+    """이미지를 내용의 sha256 으로 저장하는 저장소
 
-    while link_parser_singleton.queue_to_parse:
-        if len(link_parser_singleton.to_visit) == max_links:
-            return
+    같은 바이트는 URL 이 달라도 한 번만 저장되고, 이름이 같은 다른 이미지는 서로 덮어쓰지
+    않는다. URL -> 해시 매니페스트에 ETag/Last-Modified 를 함께 남겨서 다음 크롤에서는
+    조건부 요청을 보내고, 바뀌지 않았으면 304 하나로 끝난다.
+    """
+
+    def __init__(self, dirname="images", chunk_size=64 * 1024, timeout=10):
+        self.objects_dir = os.path.join(dirname, "objects")
+        self.manifest_path = os.path.join(dirname, "manifest.jsonl")
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.manifest = self._load_manifest()
 
-        url = link_parser_singleton.queue_to_parse.pop()
-        http = httplib2.Http()
+    def _load_manifest(self):
+        """중간에 죽어서 잘린 줄은 건너뛰고, 그런 줄이 있었으면 매니페스트를 다시 쓴다"""
+
+        manifest = {}
+        torn = False
         try:
-            status, response = http.request(url)
-        except Exception:
-            continue
-        if "text/html" not in status.get("content-type"):
-            continue
-        link_parser_singleton.to_visit.add(url)
-        print(f"Added {url} to queue")
+            with open(self.manifest_path, encoding="utf-8", errors="replace") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        manifest[entry["url"]] = entry
+                    except (ValueError, KeyError, TypeError):
+                        torn = True
+                        continue
+                    torn = torn or not line.endswith("\n")
+        except FileNotFoundError:
+            pass
 
-        bs = BeautifulSoup(response)
-        for link in BeautifulSoup.find_all(bs, "a"):
-            link_url = link.get("href")
-            if not link_url:
-                continue
+        if torn:
+            self._rewrite_manifest(manifest)
+        return manifest
+
+    def _rewrite_manifest(self, manifest):
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=os.path.dirname(self.manifest_path), delete=False
+        ) as file:
+            for entry in manifest.values():
+                file.write(json.dumps(entry) + "\n")
+        os.replace(file.name, self.manifest_path)
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    def download(self, src):
+        """src 의 해시를 돌려준다. 바뀌지 않았으면 디스크에 아무것도 쓰지 않는다"""
+
+        entry = self.manifest.get(src)
+        # 객체 파일이 지워졌다면 304 를 받아도 돌려줄 것이 없으므로 새로 받는다
+        if entry and not os.path.exists(self.object_path(entry["sha256"])):
+            entry = None
+        req = request.Request(src)
+        if entry:
+            if entry.get("etag"):
+                req.add_header("If-None-Match", entry["etag"])
+            if entry.get("last_modified"):
+                req.add_header("If-Modified-Since", entry["last_modified"])
+
+        try:
+            response = request.urlopen(req, timeout=self.timeout)
+        except HTTPError as e:
+            if e.code == 304 and entry:
+                return entry["sha256"]
+            raise
+
+        with response:
+            digest = hashlib.sha256()
+            with tempfile.NamedTemporaryFile(
+                dir=self.objects_dir, delete=False
+            ) as file:
+                try:
+                    for chunk in iter(lambda: response.read(self.chunk_size), b""):
+                        digest.update(chunk)
+                        file.write(chunk)
+                except BaseException:
+                    file.close()
+                    os.unlink(file.name)
+                    raise
+
+            sha256 = digest.hexdigest()
+            path = self.object_path(sha256)
+            if os.path.exists(path):
+                os.unlink(file.name)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(file.name, path)
+
+            self._record(
+                {
+                    "url": src,
+                    "sha256": sha256,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+            )
+        return sha256
+
+    def _record(self, entry):
+        with self.lock:
+            if self.manifest.get(entry["url"]) == entry:
+                return
+            self.manifest[entry["url"]] = entry
+            with open(self.manifest_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry) + "\n")
+
+
+class Checkpoint:
+    """크롤 상태를 gzip 저널에 이어 쓰는 체크포인트
+
+    프론티어에 들어간 URL, 방문한 페이지, 이미지까지 끝낸 페이지, 받은 이미지를 버퍼에
+    한 줄씩 모았다가 interval 초마다 백그라운드 스레드가 gzip 멤버 하나로 덧붙인다.
+    워커는 버퍼에 추가만 하므로 멈추지 않는다.
+    """
+
+    # flush 는 이 순서로 쓴다. 한 줄이 기록될 때 그보다 먼저 남긴 줄은 앞 저널에 있어야
+    # 하므로, 링크(enqueued) 뒤에 visited, 이미지(downloaded) 뒤에 processed 가 온다.
+    names = ("enqueued", "visited", "downloaded", "processed")
+
+    def __init__(self, dirname="crawl_checkpoint", interval=10):
+        self.dirname = dirname
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.buffers = {name: [] for name in self.names}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def path(self, name):
+        return os.path.join(self.dirname, name + ".log.gz")
+
+    def record(self, name, line):
+        with self.lock:
+            self.buffers[name].append(line)
+
+    def attach(self, singleton, resume=False):
+        """resume 이면 저장된 상태를 singleton 에 불러오고, 아니면 이전 저널을 지운다"""
 
-            parsed = urlparse(link_url)
-            if parsed.netloc and parsed.netloc != parsed_root.netloc:
+        os.makedirs(self.dirname, exist_ok=True)
+        if resume:
+            self.load(singleton)
+        else:
+            for name in self.names:
+                if os.path.exists(self.path(name)):
+                    os.remove(self.path(name))
+
+        singleton.checkpoint = self
+        singleton.queue_to_parse.journal = lambda url, depth: self.record(
+            "enqueued", f"{url}\t{depth}"
+        )
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            buffers = self.buffers
+            self.buffers = {name: [] for name in self.names}
+
+        for name, lines in buffers.items():
+            if not lines:
                 continue
+            with open(self.path(name), "ab") as file:
+                file.write(self._compress(lines))
+                file.flush()
+                os.fsync(file.fileno())
+
+    @staticmethod
+    def _compress(lines):
+        return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+
+    def read(self, name):
+        """중간에 죽어서 잘린 gzip 멤버와 줄바꿈 없이 끝난 마지막 줄은 건너뛴다"""
+
+        try:
+            with gzip.open(
+                self.path(name), "rt", encoding="utf-8", errors="replace"
+            ) as file:
+                for line in file:
+                    if not line.endswith("\n"):
+                        break
+                    yield line[:-1]
+        except FileNotFoundError:
+            return
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            print(f"Warning: {self.path(name)} ends with a partial checkpoint")
+
+    def rewrite(self, name, lines):
+        """저널을 lines 만 담은 gzip 멤버 하나로 원자적으로 바꾼다"""
+
+        if not lines:
+            if os.path.exists(self.path(name)):
+                os.remove(self.path(name))
+            return
+
+        with tempfile.NamedTemporaryFile(dir=self.dirname, delete=False) as file:
+            file.write(self._compress(lines))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(file.name, self.path(name))
+
+    def load(self, singleton):
+        """복구한 줄들로 저널을 다시 써서, 잘린 멤버 뒤에 새 멤버가 붙지 않게 한다"""
+
+        journals = {name: list(self.read(name)) for name in self.names}
+        for name, lines in journals.items():
+            self.rewrite(name, lines)
+
+        singleton.to_visit = set(journals["visited"])
+        singleton.downloaded = set(journals["downloaded"])
+        processed = set(journals["processed"])
+        singleton.pending_pages = list(singleton.to_visit - processed)
+
+        for line in journals["enqueued"]:
+            url, depth = line.rsplit("\t", 1)
+            singleton.queue_to_parse.restore(
+                url, int(depth), queued=url not in singleton.to_visit
+            )
+
+
+class LinkExtractor(HTMLParser):
+    """트리를 만들지 않고 <a href> 와 <img src> 만 골라내는 스트리밍 파서
+
+    feed() 로 조각을 넣을 수 있어서 응답을 다 받기 전에 파싱을 시작한다.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+        self.images = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            target, name = self.links, "href"
+        elif tag == "img":
+            target, name = self.images, "src"
+        else:
+            return
+
+        for key, value in attrs:
+            if key == name:
+                if value:
+                    target.append(value)
+                return
+
+
+def normalize_url(url):
+    """스킴과 호스트를 소문자로, 기본 포트와 쿼리/프래그먼트를 빼고, 빈 경로는 / 로"""
+
+    parsed = urlsplit(url)
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.lower()
+    if (scheme, parsed.port) in (("http", 80), ("https", 443)):
+        netloc = netloc.rsplit(":", 1)[0]
+    return urlunsplit((scheme, netloc, parsed.path or "/", "", ""))
+
+
+class BloomFilter:
+    """수백만 개의 URL 을 고정 크기 비트 배열로 기억하는 집합
+
+    거짓 양성(error_rate) 이 있어서 일부 새 URL 을 이미 본 것으로 취급할 수 있다.
+    """
+
+    def __init__(self, capacity=10000000, error_rate=0.001):
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, url):
+        digest = hashlib.blake2b(url.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, url):
+        for position in self._positions(url):
+            self.bits[position >> 3] |= 1 << (position & 7)
 
-            link_url = (parsed.scheme or parsed_root.scheme) + "://" + (
-                parsed.netloc or parsed_root.netloc
-            ) + parsed.path or ""
+    def __contains__(self, url):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(url)
+        )
 
-            if link_url in link_parser_singleton.to_visit:
+
+class Frontier:
+    """앞으로 크롤할 URL 의 FIFO 큐
+
+    정규화한 URL 을 seen 에 기록해서 같은 URL 은 한 번만 들어간다.
+    seen 은 in 과 add 만 있으면 되므로 큰 크롤에서는 BloomFilter 를 넘긴다.
+    """
+
+    def __init__(self, seen=None):
+        self.seen = set() if seen is None else seen
+        self.queue = deque()
+        self.journal = None
+
+    def push(self, url, depth=0):
+        url = normalize_url(url)
+        if url in self.seen:
+            return False
+        self.seen.add(url)
+        self._push(url, depth)
+        if self.journal:
+            self.journal(url, depth)
+        return True
+
+    def restore(self, url, depth, queued=True):
+        """체크포인트에서 읽은 URL 을 저널에 다시 남기지 않고 되살린다"""
+
+        self.seen.add(url)
+        if queued:
+            self._push(url, depth)
+
+    def pop(self):
+        """(url, depth) 를 꺼낸다"""
+        return self._pop()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def _push(self, url, depth):
+        self.queue.append((url, depth))
+
+    def _pop(self):
+        return self.queue.popleft()
+
+
+class DepthFrontier(Frontier):
+    """얕은 페이지부터 꺼내는 프론티어"""
+
+    def __init__(self, seen=None):
+        super().__init__(seen)
+        self.queue = []
+        self.counter = itertools.count()
+
+    def _push(self, url, depth):
+        heapq.heappush(self.queue, (depth, next(self.counter), url))
+
+    def _pop(self):
+        depth, _, url = heapq.heappop(self.queue)
+        return url, depth
+
+
+class HostFairFrontier(Frontier):
+    """호스트를 돌아가며 하나씩 꺼내는 프론티어"""
+
+    def __init__(self, seen=None):
+        super().__init__(seen)
+        self.queue = OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _push(self, url, depth):
+        self.queue.setdefault(urlsplit(url).netloc, deque()).append((url, depth))
+        self.size += 1
+
+    def _pop(self):
+        host, host_queue = self.queue.popitem(last=False)
+        item = host_queue.popleft()
+        if host_queue:
+            self.queue[host] = host_queue
+        self.size -= 1
+        return item
+
+
+class AsyncCrawler:
+    """한 세션의 keep-alive 연결 풀을 공유하는 asyncio 크롤러
+
+    concurrency 는 전체 동시 요청 수, per_host 는 호스트마다의 동시 연결 수이다.
+    """
+
+    def __init__(
+        self,
+        root,
+        max_links=10,
+        concurrency=10,
+        per_host=4,
+        timeout=10,
+        pages=None,
+    ):
+        """pages 가 있으면 (페이지 URL, 이미지 src 목록) 을 넣어서 이미지 워커와 동시에 진행한다"""
+
+        self.root_netloc = urlsplit(normalize_url(root)).netloc
+        self.pages = pages
+        self.max_links = max_links
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.in_progress = 0
+        self.condition = None
+        self.session = None
+
+    async def run(self):
+        self.condition = asyncio.Condition()
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency, limit_per_host=self.per_host
+        )
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout
+        ) as self.session:
+            await asyncio.gather(*(self.worker() for _ in range(self.concurrency)))
+
+    async def worker(self):
+        singleton = Singleton()
+        while True:
+            async with self.condition:
+                while not singleton.queue_to_parse and self.in_progress:
+                    await self.condition.wait()
+                if (
+                    not singleton.queue_to_parse
+                    or len(singleton.to_visit) >= self.max_links
+                ):
+                    self.condition.notify_all()
+                    return
+                url, depth = singleton.queue_to_parse.pop()
+                self.in_progress += 1
+
+            try:
+                await self.visit(url, depth)
+            finally:
+                async with self.condition:
+                    self.in_progress -= 1
+                    self.condition.notify_all()
+
+    async def visit(self, url, depth):
+        singleton = Singleton()
+        extractor = LinkExtractor()
+        try:
+            async with self.session.get(url) as response:
+                if "text/html" not in response.headers.get("content-type", ""):
+                    return
+                try:
+                    decoder = codecs.getincrementaldecoder(response.charset or "utf-8")
+                except LookupError:
+                    decoder = codecs.getincrementaldecoder("utf-8")
+                decoder = decoder(errors="replace")
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    extractor.feed(decoder.decode(chunk))
+                extractor.feed(decoder.decode(b"", final=True))
+                extractor.close()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return
+
+        if len(singleton.to_visit) >= self.max_links:
+            return
+
+        # 링크를 먼저 넣어야 체크포인트에 visited 가 남을 때 그 링크들도 enqueued 에 있다
+        for link_url in extractor.links:
+            try:
+                link_url = normalize_url(urljoin(url, link_url))
+            except ValueError:
+                # http://host:abc/ 나 http://[bad/ 같은 href 는 건너뛴다
+                continue
+            parsed = urlsplit(link_url)
+            if parsed.scheme not in ("http", "https"):
+                continue
+            if parsed.netloc != self.root_netloc:
                 continue
 
-            link_parser_singleton.queue_to_parse = [
-                link_url
-            ] + link_parser_singleton.queue_to_parse
+            singleton.queue_to_parse.push(link_url, depth + 1)
+
+        singleton.mark_visited(url)
+        print(f"Added {url} to queue")
+        if self.pages is not None:
+            await self.publish((url, extractor.images))
+
+    async def publish(self, page):
+        """pages 가 가득 차 있으면 이 워커의 크롤을 멈추고 자리가 날 때까지 기다린다
+
+        블로킹 put 은 실행기 스레드에서 기다리므로 이벤트 루프의 다른 워커는 계속 돈다.
+        """
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, put_page, self.pages, page, Singleton().image_threads
+        )
+
+
+def put_page(pages, page, threads, timeout=0.5):
+    """threads 중 하나라도 살아 있는 동안만 pages 에 자리가 나기를 기다린다
+
+    워커가 모두 죽었으면 큐를 비울 스레드가 없으므로 넣지 않고 False 를 돌려준다.
+    """
+
+    while any(thread.is_alive() for thread in threads):
+        try:
+            pages.put(page, timeout=timeout)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def traverse_site(max_links=10, concurrency=10, per_host=4, timeout=10, pages=None):
+    link_parser_singleton = Singleton()
+    crawler = AsyncCrawler(
+        link_parser_singleton.root, max_links, concurrency, per_host, timeout, pages
+    )
+    asyncio.run(crawler.run())
+
+
+def crawl_and_download(max_links=10, image_workers=2, queue_size=100, **options):
+    """크롤러가 찾은 페이지를 bounded 큐로 이미지 워커들에게 넘겨 두 단계를 겹쳐 돌린다"""
+
+    singleton = Singleton()
+    singleton.pages = queue.Queue(maxsize=queue_size)
+    singleton.image_store = ImageStore("images")
+
+    threads = singleton.image_threads = [
+        ImageDownLoaderThread(i, f"Thread-{i}", i) for i in range(1, image_workers + 1)
+    ]
+    for thread in threads:
+        thread.start()
+    for url in getattr(singleton, "pending_pages", ()):
+        put_page(singleton.pages, (url, None), threads)
+
+    try:
+        traverse_site(max_links, pages=singleton.pages, **options)
+    finally:
+        for _ in threads:
+            put_page(singleton.pages, None, threads)
+        for thread in threads:
+            thread.join()
 
 
 def download_images(thread_name):
     singleton = Singleton()
-    while singleton.to_visit:
-        url = singleton.to_visit.pop()
+    http = httplib2.Http()
+    while True:
+        page = singleton.pages.get()
+        if page is None:
+            return
 
-        http = httplib2.Http()
+        url, images = page
         print(f"{thread_name} Starting downloading images from {url}")
-
         try:
-            status, response = http.request(url)
-        except Exception:
+            download_page_images(singleton, http, thread_name, url, images)
+        except Exception as e:
+            # 한 페이지의 실패로 워커가 죽으면 pages 를 비울 스레드가 줄어든다
+            print(f"{thread_name} failed to process {url}: {e}")
             continue
 
-        bs = BeautifulSoup(response)
+        singleton.mark_processed(url)
+        print(f"{thread_name} finished downloading images from {url}")
+
 
-        images = BeautifulSoup.find_all(bs, "img")
+def download_page_images(singleton, http, thread_name, url, images):
+    if images is None:
+        # 체크포인트에서 되살린 페이지는 크롤러가 추출한 결과가 없어서 다시 읽는다
+        status, response = http.request(url)
+        extractor = LinkExtractor()
+        extractor.feed(response.decode("utf-8", errors="replace"))
+        extractor.close()
+        images = extractor.images
 
-        for image in images:
-            src = image.get("src")
+    for src in images:
+        try:
             src = urljoin(url, src)
+        except ValueError:
+            # http://[bad/x.png 같은 src 는 건너뛴다
+            continue
 
-            basename = os.path.basename(src)
-            if src not in singleton.downloaded:
-                singleton.downloaded.add(src)
-                print(f"Downloading {src}")
-                request.urlretrieve(src, os.path.join("images", basename))
-
-        print(f"{thread_name} finished downloading images from {url}")
+        if singleton.mark_downloaded(src):
+            print(f"Downloading {src}")
+            try:
+                singleton.image_store.download(src)
+            except Exception as e:
+                print(f"{thread_name} failed to download {src}: {e}")
+            else:
+                singleton.record_downloaded(src)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--checkpoint-dir", default="crawl_checkpoint")
+    args = parser.parse_args()
+
     root = "https://python.org"
-    parsed_root = urlparse(root)
 
     singleton = Singleton()
-    singleton.queue_to_parse = [root]
+    singleton.root = root
+    singleton.queue_to_parse = Frontier()
     singleton.to_visit = set()
     singleton.downloaded = set()
 
-    traverse_site()
-
-    if not os.path.exists("images"):
-        os.makedirs("images")
-
-    thread1 = ImageDownLoaderThread(1, "Thread-1", 1)
-    thread2 = ImageDownLoaderThread(2, "Thread-2", 2)
+    checkpoint = Checkpoint(args.checkpoint_dir)
+    checkpoint.attach(singleton, resume=args.resume)
+    singleton.queue_to_parse.push(root)
 
-    thread1.start()
-    thread2.start()
+    try:
+        crawl_and_download(image_workers=4)
+    finally:
+        checkpoint.close()
@@ -0,0 +1,87 @@
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+from crawler import Frontier, Singleton, crawl_and_download
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    """page0.html 부터 차례로 이어지는 사이트. bad 에 든 페이지는 깨진 src 를 하나 더 갖는다"""
+
+    pages = 300
+    bad = {10, 60, 110, 160, 210, 260}
+
+    def do_GET(self):
+        if self.path.startswith("/img"):
+            body, content_type = self.path.encode("utf-8"), "image/png"
+        else:
+            i = int(self.path.removeprefix("/page").removesuffix(".html"))
+            html = f'<img src="/img{i}.png">'
+            if i + 1 < self.pages:
+                html += f'<a href="/page{i + 1}.html">next</a>'
+            if i in self.bad:
+                html += '<img src="http://[bad/x.png">'
+            body, content_type = html.encode("utf-8"), "text/html; charset=utf-8"
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CrawlAndDownloadTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), SiteHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.TemporaryDirectory()
+        os.chdir(self.workdir.name)
+
+        if hasattr(Singleton, "instance"):
+            del Singleton.instance
+        singleton = Singleton()
+        singleton.root = f"http://127.0.0.1:{self.server.server_port}/page0.html"
+        singleton.queue_to_parse = Frontier()
+        singleton.to_visit = set()
+        singleton.downloaded = set()
+        singleton.queue_to_parse.push(singleton.root)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.workdir.cleanup()
+
+    def test_malformed_image_src_does_not_stall_the_crawl(self):
+        def crawl():
+            with contextlib.redirect_stdout(io.StringIO()):
+                crawl_and_download(
+                    max_links=SiteHandler.pages, image_workers=2, queue_size=4
+                )
+
+        thread = threading.Thread(target=crawl, daemon=True)
+        thread.start()
+        thread.join(timeout=60)
+
+        self.assertFalse(thread.is_alive(), "crawl_and_download did not finish")
+        singleton = Singleton()
+        self.assertEqual(len(singleton.to_visit), SiteHandler.pages)
+        self.assertEqual(len(singleton.image_store.manifest), SiteHandler.pages)
+
+
+if __name__ == "__main__":
+    unittest.main()